@@ -0,0 +1,19 @@
+# encoding: utf-8
+import statistics
+import time
+
+
+async def median_ms(func, repeat=15, warmup=2):
+    """
+    Awaits func() warmup + repeat times and returns the median runtime of the timed
+    calls in ms.
+    """
+    for _ in range(warmup):
+        await func()
+
+    runtimes = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        runtimes.append((time.perf_counter() - start) * 1000)
+    return statistics.median(runtimes)
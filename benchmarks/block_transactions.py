@@ -0,0 +1,87 @@
+# encoding: utf-8
+# Block transaction lookups through the GIN index on transactions.block_hash compared
+# with the block_transactions mapping, for blocks below the mapping's watermark. Run
+# update_block_transactions (BLOCK_TRANSACTIONS_TABLE=true) first. Reads from SQL_URI:
+#   SQL_URI=... SPECTRED_HOST_1=... pipenv run python -m benchmarks.block_transactions
+import asyncio
+import random
+import sys
+
+from sqlalchemy import text
+
+from benchmarks import median_ms
+from dbsession import async_session
+from endpoints import get_blocks
+from helper import KeyValueStore, WorkerSnapshot
+
+
+async def _block_hashes():
+    async with async_session() as s:
+        watermark = await KeyValueStore.read(s, "block_transactions_watermark")
+        if watermark is None:
+            return None, []
+        result = await s.execute(
+            text("SELECT hash FROM blocks WHERE blue_score <= :watermark"),
+            {"watermark": int(watermark)},
+        )
+        return int(watermark), result.scalars().all()
+
+
+async def _lookup(query, block_hashes):
+    async with async_session() as s:
+        return (await s.execute(query, {"block_hashes": block_hashes})).all()
+
+
+async def _transactions(block_hashes, mapped):
+    get_blocks.BLOCK_TRANSACTIONS_TABLE = mapped
+    return await get_blocks.get_blocks_transactions(block_hashes)
+
+
+def _transaction_ids(blocks_transactions):
+    return {
+        block_hash: sorted(tx["verboseData"]["transactionId"] for tx in transactions)
+        for block_hash, transactions in blocks_transactions.items()
+    }
+
+
+# postgres plans the first 5 executions of a prepared statement on each pooled
+# connection for their parameters, later ones may use a generic plan
+_WARMUP = 30
+
+
+async def main():
+    watermark, block_hashes = await _block_hashes()
+    if not block_hashes:
+        sys.exit("block_transactions is empty, run update_block_transactions first")
+    WorkerSnapshot.publish("block_transactions", {"blue_score": watermark})
+
+    random.seed(2)
+    for count in (1, 100, 500):
+        sample = random.sample(block_hashes, min(count, len(block_hashes)))
+
+        assert _transaction_ids(await _transactions(sample, False)) == _transaction_ids(
+            await _transactions(sample, True)
+        ), f"{count} blocks: transactions differ"
+
+        gin = await median_ms(
+            lambda: _lookup(get_blocks._BLOCKS_TRANSACTIONS_QUERY, sample),
+            warmup=_WARMUP,
+        )
+        mapping = await median_ms(
+            lambda: _lookup(get_blocks._MAPPED_BLOCKS_TRANSACTIONS_QUERY, sample),
+            warmup=_WARMUP,
+        )
+        gin_total = await median_ms(
+            lambda: _transactions(sample, False), warmup=_WARMUP
+        )
+        mapping_total = await median_ms(
+            lambda: _transactions(sample, True), warmup=_WARMUP
+        )
+        print(
+            f"{count} blocks: lookup GIN {gin:.2f} ms, mapping {mapping:.2f} ms;"
+            f" with inputs and outputs GIN {gin_total:.1f} ms, mapping {mapping_total:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+# encoding: utf-8
+# Latency of the transaction, input and output reads of query_transactions() with
+# dbsession.gather_reads() run one after another (concurrency 1) and concurrently on
+# separate pooled connections. Reads from SQL_URI:
+#   SQL_URI=... SPECTRED_HOST_1=... pipenv run python -m benchmarks.gather_reads
+import asyncio
+
+from sqlalchemy import text
+
+from benchmarks import median_ms
+from dbsession import async_session, engine, gather_reads
+from endpoints.get_transactions import _load_inputs, _load_outputs, _load_transactions
+
+
+async def _transaction_ids():
+    async with async_session() as s:
+        result = await s.execute(
+            text("SELECT transaction_id FROM transactions LIMIT 1000")
+        )
+        return result.scalars().all()
+
+
+async def main():
+    transaction_ids = await _transaction_ids()
+
+    for name, ids, resolve_previous_outpoints in (
+        ("single id", transaction_ids[:1], "no"),
+        ("1000 ids", transaction_ids, "no"),
+        ("50 ids, resolve full", transaction_ids[:50], "full"),
+    ):
+        for concurrency in (1, 3):
+
+            async def reads():
+                return await gather_reads(
+                    lambda s: _load_transactions(s, ids, []),
+                    lambda s: _load_inputs(s, ids, resolve_previous_outpoints),
+                    lambda s: _load_outputs(s, ids),
+                    concurrency=concurrency,
+                )
+
+            checkouts = engine.pool.checkouts
+            await reads()
+            checkouts = engine.pool.checkouts - checkouts
+            print(
+                f"{name}, concurrency {concurrency}: {await median_ms(reads, repeat=21):.1f} ms,"
+                f" {checkouts} connection checkouts"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+# encoding: utf-8
+# Compares spectred.message_to_dict with json_format.MessageToDict on the hot node
+# responses. Needs no node or database:
+#   pipenv run python -m benchmarks.message_to_dict
+import time
+
+from google.protobuf import json_format
+
+from spectred.message_to_dict import message_to_dict
+from spectred.messages_pb2 import SpectredResponse
+
+
+def _block_response(transactions=300):
+    response = SpectredResponse()
+    block = response.getBlockResponse.block
+    block.header.version = 1
+    block.header.blueScore = 123
+    block.header.parents.add().parentHashes.extend(["ab" * 32] * 3)
+    for _ in range(transactions):
+        tx = block.transactions.add()
+        tx.subnetworkId = "00" * 20
+        for index in range(3):
+            tx_input = tx.inputs.add()
+            tx_input.previousOutpoint.transactionId = "cd" * 32
+            tx_input.previousOutpoint.index = index
+            tx_input.signatureScript = "41" * 66
+            tx_input.sigOpCount = 1
+        for index in range(2):
+            output = tx.outputs.add()
+            output.amount = 1000 + index
+            output.scriptPublicKey.scriptPublicKey = "20" * 34
+            output.verboseData.scriptPublicKeyAddress = "spectre:q"
+            output.verboseData.scriptPublicKeyType = "pubkey"
+        tx.verboseData.transactionId = "ef" * 32
+        tx.verboseData.computeMass = 2036
+    return response
+
+
+def _utxos_response(entries=10000):
+    response = SpectredResponse()
+    for index in range(entries):
+        entry = response.getUtxosByAddressesResponse.entries.add()
+        entry.address = "spectre:q"
+        entry.outpoint.transactionId = "ab" * 32
+        entry.outpoint.index = index
+        entry.utxoEntry.amount = 1000
+        entry.utxoEntry.scriptPublicKey.scriptPublicKey = "20" * 34
+        entry.utxoEntry.blockDaaScore = 1234
+    return response
+
+
+def _block_dag_info_response():
+    response = SpectredResponse()
+    info = response.getBlockDagInfoResponse
+    info.networkName = "spectre-mainnet"
+    info.blockCount = 5
+    info.tipHashes.extend(["ab" * 32] * 3)
+    info.difficulty = 1.5
+    return response
+
+
+def _ms_per_call(func, message, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(message)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def _message_to_dict_reference(message):
+    return json_format.MessageToDict(message, always_print_fields_with_no_presence=True)
+
+
+def main():
+    for name, message, repeat in (
+        ("getBlockResponse, 300 txs", _block_response(), 20),
+        ("getUtxosByAddressesResponse, 10k utxos", _utxos_response(), 5),
+        ("getBlockDagInfoResponse", _block_dag_info_response(), 20000),
+    ):
+        assert message_to_dict(message) == _message_to_dict_reference(message)
+        before = _ms_per_call(_message_to_dict_reference, message, repeat)
+        after = _ms_per_call(message_to_dict, message, repeat)
+        print(f"{name}: {before:.3f} ms -> {after:.3f} ms ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# encoding: utf-8
+# Per query overhead of the statements built per request with an expanding IN compared
+# with the cached "= ANY(array)" statements of queries.transactions. Reads from SQL_URI:
+#   SQL_URI=... pipenv run python -m benchmarks.statement_cache
+import asyncio
+import random
+import time
+import timeit
+
+from sqlalchemy import text
+from sqlalchemy.future import select
+
+import dbsession
+from models.Transaction import Transaction, TransactionOutput
+from queries.transactions import OUTPUTS_QUERY, select_transactions, transactions_query
+
+
+def _outputs_statement(transaction_ids):
+    return select(TransactionOutput).filter(
+        TransactionOutput.transaction_id.in_(transaction_ids)
+    )
+
+
+def _transactions_statement(transaction_ids):
+    return (
+        select_transactions([])
+        .filter(Transaction.transaction_id.in_(transaction_ids))
+        .order_by(Transaction.block_time.desc(), Transaction.transaction_id)
+    )
+
+
+async def _outputs_built(s, transaction_ids):
+    return (await s.execute(_outputs_statement(transaction_ids))).all()
+
+
+async def _outputs_cached(s, transaction_ids):
+    return (await s.execute(OUTPUTS_QUERY, {"transaction_ids": transaction_ids})).all()
+
+
+async def _transactions_built(s, transaction_ids):
+    return (await s.execute(_transactions_statement(transaction_ids))).all()
+
+
+async def _transactions_cached(s, transaction_ids):
+    return (
+        await s.execute(
+            transactions_query(frozenset()), {"transaction_ids": transaction_ids}
+        )
+    ).all()
+
+
+def _construction_us(func):
+    return timeit.timeit(func, number=5000) / 5000 * 1e6
+
+
+async def main():
+    async with dbsession.async_session() as s:
+        result = await s.execute(
+            text("SELECT transaction_id FROM transactions LIMIT 10000")
+        )
+        transaction_ids = result.scalars().all()
+
+    random.seed(1)
+    batches = [
+        random.sample(transaction_ids, random.randint(1, 50)) for _ in range(400)
+    ]
+
+    ids = batches[0]
+    print(
+        f"statement construction: outputs {_construction_us(lambda: _outputs_statement(ids)):.1f} us,"
+        f" transactions {_construction_us(lambda: _transactions_statement(ids)):.1f} us,"
+        f" cached {_construction_us(lambda: transactions_query(frozenset())):.2f} us"
+    )
+
+    for name, query in (
+        ("outputs by ids, built", _outputs_built),
+        ("outputs by ids, cached", _outputs_cached),
+        ("transactions by ids, built", _transactions_built),
+        ("transactions by ids, cached", _transactions_cached),
+    ):
+        # one connection, its prepared statement cache is warmed by the first batches
+        async with dbsession.async_session() as s:
+            for batch in batches[:50]:
+                await query(s, batch)
+
+            misses = dbsession._statement_metrics["prepared_statement_misses"]
+            start = time.perf_counter()
+            for batch in batches:
+                await query(s, batch)
+            runtime = (time.perf_counter() - start) / len(batches) * 1000
+            misses = dbsession._statement_metrics["prepared_statement_misses"] - misses
+
+        print(
+            f"{name}: {runtime:.2f} ms/query,"
+            f" {misses}/{len(batches)} prepared statement misses"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+# encoding: utf-8
+# End to end latency of the transaction search and the full transactions of an address
+# with the "orm" and the "json" query engine (TX_QUERY_ENGINE). Reads from SQL_URI, the
+# node is not contacted:
+#   SQL_URI=... SPECTRED_HOST_1=... pipenv run python -m benchmarks.transaction_search
+import asyncio
+
+import httpx
+from sqlalchemy import text
+
+from benchmarks import median_ms
+from dbsession import async_session
+from endpoints import get_transactions
+from main import app
+
+
+async def _sample():
+    async with async_session() as s:
+        transaction_ids = await s.execute(
+            text("SELECT transaction_id FROM transactions LIMIT 1000")
+        )
+        address = await s.execute(
+            text(
+                "SELECT address FROM tx_id_address_mapping"
+                " GROUP BY address ORDER BY count(*) DESC LIMIT 1"
+            )
+        )
+        return transaction_ids.scalars().all(), address.scalar()
+
+
+async def main():
+    transaction_ids, address = await _sample()
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://benchmark"
+    ) as client:
+        requests = {
+            "search, 1000 ids": lambda: client.post(
+                "/transactions/search", json={"transactionIds": transaction_ids}
+            ),
+            "search, 50 ids, resolve full": lambda: client.post(
+                "/transactions/search",
+                params={"resolve_previous_outpoints": "full"},
+                json={"transactionIds": transaction_ids[:50]},
+            ),
+            "full-transactions, limit 500": lambda: client.get(
+                f"/addresses/{address}/full-transactions", params={"limit": 500}
+            ),
+        }
+
+        for name, request in requests.items():
+            results = {}
+            for engine in ("orm", "json"):
+                get_transactions.USE_JSON_QUERY_ENGINE = engine == "json"
+                response = await request()
+                response.raise_for_status()
+                results[engine] = (await median_ms(request, repeat=5), response.json())
+
+            assert results["orm"][1] == results["json"][1], f"{name}: responses differ"
+            print(
+                f"{name}: orm {results['orm'][0]:.1f} ms, json {results['json'][0]:.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,21 +1,333 @@
+import asyncio
+import contextvars
 import logging
 import os
+import random
+import time
 
+from sqlalchemy import event, exc, text
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 _logger = logging.getLogger(__name__)
 
-engine = create_async_engine(
-    os.getenv("SQL_URI", "postgresql+asyncpg://127.0.0.1:5432"),
-    pool_pre_ping=True,
-    echo=False,
+# max. pooled connections a single request may use for concurrent reads. With 1, the
+# reads of a request run one after another in one session.
+DB_REQUEST_CONCURRENCY = int(os.getenv("DB_REQUEST_CONCURRENCY", "1"))
+
+# a read replica is only used, if its latest block is at most this many blue scores
+# behind the node
+SQL_READ_MAX_LAG = int(os.getenv("SQL_READ_MAX_LAG", "600"))
+SQL_READ_CHECK_TIMEOUT = int(os.getenv("SQL_READ_CHECK_TIMEOUT", "5"))
+
+# SQLAlchemy's compiled SQL cache per engine and asyncpg's prepared statements per connection
+SQL_QUERY_CACHE_SIZE = int(os.getenv("SQL_QUERY_CACHE_SIZE", "500"))
+SQL_PREPARED_STATEMENT_CACHE_SIZE = int(
+    os.getenv("SQL_PREPARED_STATEMENT_CACHE_SIZE", "500")
 )
+
+# connection pool per engine. Idle connections are validated every
+# SQL_POOL_VALIDATE_INTERVAL seconds instead of pinging on each checkout.
+SQL_POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", "5"))
+SQL_POOL_MAX_OVERFLOW = int(os.getenv("SQL_POOL_MAX_OVERFLOW", "10"))
+SQL_POOL_TIMEOUT = int(os.getenv("SQL_POOL_TIMEOUT", "30"))
+SQL_POOL_RECYCLE = int(os.getenv("SQL_POOL_RECYCLE", "-1"))
+SQL_POOL_VALIDATE_INTERVAL = int(os.getenv("SQL_POOL_VALIDATE_INTERVAL", "30"))
+
+# default statement timeout in ms (0 = none). It is a server setting of the connections, so
+# it costs nothing per query. Endpoints set their own limits with statement_timeout().
+SQL_STATEMENT_TIMEOUT = int(os.getenv("SQL_STATEMENT_TIMEOUT", "0"))
+
+_statement_timeout = contextvars.ContextVar("statement_timeout", default=None)
+
+_statement_metrics = {
+    "statements": 0,
+    "compiled_cache_hits": 0,
+    "compiled_cache_misses": 0,
+    "prepared_statement_hits": 0,
+    "prepared_statement_misses": 0,
+}
+
+
+def _prepared_statement_cache(cursor):
+    # asyncpg adapter internals, None if not available
+    return getattr(
+        getattr(cursor, "_adapt_connection", None), "_prepared_statement_cache", None
+    )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    cache = _prepared_statement_cache(cursor)
+    context._prepared_statements_before = len(cache) if cache is not None else None
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _statement_metrics["statements"] += 1
+
+    if context.cache_hit is CACHE_HIT:
+        _statement_metrics["compiled_cache_hits"] += 1
+    elif context.cache_hit is CACHE_MISS:
+        _statement_metrics["compiled_cache_misses"] += 1
+
+    cache = _prepared_statement_cache(cursor)
+    if cache is not None and context._prepared_statements_before is not None:
+        # a statement, which is not cached yet, is prepared and added
+        if len(cache) > context._prepared_statements_before:
+            _statement_metrics["prepared_statement_misses"] += 1
+        else:
+            _statement_metrics["prepared_statement_hits"] += 1
+
+
+class _InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool recording how long checkouts wait for a connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.checkout_timeouts += 1
+            raise
+
+        wait = time.perf_counter() - start
+        self.checkouts += 1
+        self.checkout_wait_total += wait
+        self.checkout_wait_max = max(self.checkout_wait_max, wait)
+        return connection
+
+
+def _create_engine(uri):
+    connect_args = {"prepared_statement_cache_size": SQL_PREPARED_STATEMENT_CACHE_SIZE}
+    if SQL_STATEMENT_TIMEOUT:
+        connect_args["server_settings"] = {
+            "statement_timeout": str(SQL_STATEMENT_TIMEOUT)
+        }
+
+    new_engine = create_async_engine(
+        uri,
+        echo=False,
+        poolclass=_InstrumentedPool,
+        pool_size=SQL_POOL_SIZE,
+        max_overflow=SQL_POOL_MAX_OVERFLOW,
+        pool_timeout=SQL_POOL_TIMEOUT,
+        pool_recycle=SQL_POOL_RECYCLE,
+        query_cache_size=SQL_QUERY_CACHE_SIZE,
+        connect_args=connect_args,
+    )
+    event.listen(
+        new_engine.sync_engine, "before_cursor_execute", _before_cursor_execute
+    )
+    event.listen(new_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    return new_engine
+
+
+engine = _create_engine(os.getenv("SQL_URI", "postgresql+asyncpg://127.0.0.1:5432"))
 Base = declarative_base()
 
 session_maker = sessionmaker(engine)
-async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+# writes only: KeyValueStore and the background jobs maintaining address_tx_counts,
+# hashrate_history, block_transactions and the settled sync cursor. Reads use
+# async_session()
+async_session_primary = sessionmaker(
+    engine, expire_on_commit=False, class_=AsyncSession
+)
+
+read_engines = []
+
+for i in range(100):
+    try:
+        read_engines.append(_create_engine(os.environ[f"SQL_URI_READ_{i + 1}"].strip()))
+    except KeyError:
+        break
+
+_read_session_makers = [
+    sessionmaker(e, expire_on_commit=False, class_=AsyncSession) for e in read_engines
+]
+# indexes of the replicas passing the last check. None until the first check.
+_usable_replicas = None
+
+
+@event.listens_for(Session, "after_begin")
+def _apply_statement_timeout(session, transaction, connection):
+    timeout = _statement_timeout.get()
+    # a limit other than the connection's default costs a round trip per transaction
+    if timeout is not None and timeout != SQL_STATEMENT_TIMEOUT:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+
+
+def set_statement_timeout(milliseconds):
+    """
+    Sets the statement timeout for the sessions opened in the current context (request).
+    Returns a token for reset_statement_timeout().
+    """
+    return _statement_timeout.set(milliseconds)
+
+
+def reset_statement_timeout(token):
+    _statement_timeout.reset(token)
+
+
+def is_query_canceled(err):
+    """
+    True if err is a statement cancelled by the statement timeout (query_canceled).
+    Server side cursors raise it as asyncpg error, otherwise it is wrapped in a DBAPIError.
+    """
+    orig = getattr(err, "orig", err)
+    return "57014" in (getattr(orig, "pgcode", None), getattr(orig, "sqlstate", None))
+
+
+def _read_session_maker():
+    if _usable_replicas:
+        return _read_session_makers[random.choice(_usable_replicas)]
+    return async_session_primary
+
+
+def async_session():
+    """
+    Returns a session for read-only queries on a usable read replica or the primary.
+    """
+    return _read_session_maker()()
+
+
+async def _replica_blue_score(read_engine):
+    async with read_engine.connect() as conn:
+        result = await conn.execute(text("SELECT max(blue_score) FROM blocks"))
+        return result.scalar()
+
+
+async def check_read_replicas(node_blue_score=None):
+    """
+    Selects the read replicas, which are reachable and not lagging more than SQL_READ_MAX_LAG
+    behind node_blue_score. Without a node blue score only reachability is checked.
+    """
+    global _usable_replicas
+
+    results = await asyncio.gather(
+        *(
+            asyncio.wait_for(_replica_blue_score(e), SQL_READ_CHECK_TIMEOUT)
+            for e in read_engines
+        ),
+        return_exceptions=True,
+    )
+
+    usable = []
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            reason = f"check failed: {result!r}"
+        elif node_blue_score is not None and (
+            result is None or node_blue_score - result > SQL_READ_MAX_LAG
+        ):
+            reason = f"lagging, blue score {result} vs node {node_blue_score}"
+        else:
+            usable.append(i)
+            continue
+
+        if _usable_replicas is None or i in _usable_replicas:
+            _logger.warning(f"Read replica SQL_URI_READ_{i + 1} not used, {reason}")
+
+    for i in usable:
+        if not _usable_replicas or i not in _usable_replicas:
+            _logger.info(f"Using read replica SQL_URI_READ_{i + 1}")
+
+    if not usable and read_engines and _usable_replicas != []:
+        _logger.warning("No usable read replica. Reading from the primary.")
+
+    _usable_replicas = usable
+
+
+async def gather_reads(*reads, concurrency=DB_REQUEST_CONCURRENCY):
+    """
+    Runs independent read queries. A read is an async function taking the session and
+    returning loaded results. None entries are not run and return None.
+    With a concurrency above 1, the reads run concurrently, each in its own session and
+    thus on its own pooled connection.
+    """
+    # all reads of a request see the same database
+    read_session = _read_session_maker()
+
+    if concurrency <= 1:
+        async with read_session() as s:
+            return [await read(s) if read else None for read in reads]
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(read):
+        if read is None:
+            return None
+        async with semaphore:
+            async with read_session() as s:
+                return await read(s)
+
+    return await asyncio.gather(*(run(read) for read in reads))
+
+
+def _engines():
+    return {
+        "primary": engine,
+        **{f"read_{i + 1}": e for i, e in enumerate(read_engines)},
+    }
+
+
+async def validate_pools():
+    """
+    Checks each idle pooled connection with SELECT 1. A broken connection invalidates
+    the pool, so all its connections are replaced on their next checkout.
+    """
+    for name, e in _engines().items():
+        # the pool is FIFO, so checking out one by one visits every idle connection
+        for _ in range(e.sync_engine.pool.checkedin()):
+            try:
+                async with e.connect() as conn:
+                    await conn.execute(text("SELECT 1"))
+            except Exception as err:
+                _logger.warning(f"Invalid connection in {name} pool: {err!r}")
+                break
+
+
+def _pool_metrics(pool):
+    return {
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "checkouts": pool.checkouts,
+        "checkout_timeouts": pool.checkout_timeouts,
+        "checkout_wait_avg_ms": pool.checkout_wait_total / pool.checkouts * 1000
+        if pool.checkouts
+        else 0,
+        "checkout_wait_max_ms": pool.checkout_wait_max * 1000,
+    }
+
+
+def get_metrics():
+    """
+    Statement cache and pool metrics of all engines since the start of this worker.
+    """
+    engines = _engines()
+    return {
+        **_statement_metrics,
+        "compiled_cache_size": SQL_QUERY_CACHE_SIZE,
+        "compiled_cache_entries": sum(
+            len(e.sync_engine._compiled_cache or ()) for e in engines.values()
+        ),
+        "prepared_statement_cache_size": SQL_PREPARED_STATEMENT_CACHE_SIZE,
+        "pools": {
+            name: _pool_metrics(e.sync_engine.pool) for name, e in engines.items()
+        },
+    }
 
 
 async def create_all(drop=False):
@@ -2,7 +2,15 @@
 import os
 from functools import wraps
 
+from asyncpg import PostgresError
 from fastapi import HTTPException
+from sqlalchemy.exc import DBAPIError
+from starlette.requests import Request
+
+import dbsession
+
+PROTOBUF_MEDIA_TYPE = "application/x-protobuf"
+PROTOBUF_RESPONSE = {200: {"content": {PROTOBUF_MEDIA_TYPE: {}}}}
 
 
 def filter_fields(response_dict, fields):
@@ -12,6 +20,13 @@ def filter_fields(response_dict, fields):
         return response_dict
 
 
+def accepts_protobuf(request: Request):
+    """
+    True if the client asked for the raw protobuf message via the Accept header.
+    """
+    return PROTOBUF_MEDIA_TYPE in request.headers.get("accept", "")
+
+
 def sql_db_only(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):
@@ -24,3 +39,29 @@ def sql_db_only(func):
         return await func(*args, **kwargs)
 
     return wrapper
+
+
+def statement_timeout(milliseconds):
+    """
+    Limits each SQL statement of the endpoint to the given runtime (0 = no limit). Cancelled
+    statements result in a 504. Without it, SQL_STATEMENT_TIMEOUT applies.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = dbsession.set_statement_timeout(milliseconds)
+            try:
+                return await func(*args, **kwargs)
+            except (DBAPIError, PostgresError) as err:
+                if dbsession.is_query_canceled(err):
+                    raise HTTPException(
+                        status_code=504, detail="Database query timed out."
+                    )
+                raise
+            finally:
+                dbsession.reset_statement_timeout(token)
+
+        return wrapper
+
+    return decorator
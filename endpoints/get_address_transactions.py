@@ -1,17 +1,36 @@
 # encoding: utf-8
+import json
 import os
+import time
 from enum import Enum
 from typing import List
 
-from fastapi import Path, Query
-from pydantic import BaseModel
-from sqlalchemy import text, func
+from fastapi import HTTPException, Path, Query, Response
+from fastapi_utils.tasks import repeat_every
+from pydantic import BaseModel, constr
+from starlette.responses import StreamingResponse
+from sqlalchemy import BigInteger, bindparam, cast, text, func
 from sqlalchemy.future import select
 
-from dbsession import async_session
-from endpoints import sql_db_only
-from endpoints.get_transactions import search_for_transactions, TxSearch, TxModel
+from dbsession import async_session, async_session_primary
+from endpoints import filter_fields, sql_db_only, statement_timeout
+from endpoints.get_mempool import get_mempool_transactions_for_addresses
+from endpoints.get_transactions import (
+    DESC_MEMPOOL_PARAM,
+    query_transactions,
+    search_for_transactions,
+    TxSearch,
+    TxModel,
+)
+from helper import KeyValueStore, WorkerSnapshot
+from models.AddressTxCount import AddressTxCount
 from models.TxAddrMapping import TxAddrMapping
+from models.Variable import KeyValueModel
+from queries.addresses import (
+    MAPPINGS_FOR_ADDRESSES_QUERY,
+    TX_IDS_FOR_ADDRESS_QUERY,
+    TX_IDS_FOR_ADDRESSES_QUERY,
+)
 from server import app
 
 DESC_RESOLVE_PARAM = (
@@ -20,6 +39,61 @@ DESC_RESOLVE_PARAM = (
     "adds it into each TxInput."
 )
 SPECTRE_ADDRESS_PREFIX = os.getenv("ADDRESS_PREFIX", "spectre")
+ADDRESS_STATEMENT_TIMEOUT = int(os.getenv("SQL_STATEMENT_TIMEOUT_ADDRESSES", "30000"))
+IS_SQL_DB_CONFIGURED = os.getenv("SQL_URI") is not None
+ADDRESS_REGEX = r"^" + SPECTRE_ADDRESS_PREFIX + r"\:[a-z0-9]{61,63}$"
+MAX_TIMELINE_ADDRESSES = int(os.getenv("MAX_TIMELINE_ADDRESSES", "500"))
+# acceptance changes are reported for transactions this many ms older than the sync cursor
+SYNC_ACCEPTANCE_WINDOW = int(os.getenv("SYNC_ACCEPTANCE_WINDOW", "600000"))
+# max. tx_id_address_mapping ids added to the address counters per statement
+ADDRESS_TX_COUNT_BATCH = int(os.getenv("ADDRESS_TX_COUNT_BATCH", "200000"))
+
+# acceptance of the transactions of several addresses between :block_time and
+# :to_block_time, via idx_address_block_time_tx_id
+_ACCEPTANCE_FOR_ADDRESSES_QUERY = text("""
+    SELECT t.transaction_id, t.is_accepted, t.accepting_block_hash,
+           b.blue_score AS accepting_block_blue_score
+    FROM (
+        SELECT DISTINCT m.transaction_id
+        FROM unnest(CAST(:addresses AS varchar[])) AS a(address)
+        JOIN tx_id_address_mapping m
+          ON m.address = a.address
+         AND m.block_time >= :block_time AND m.block_time <= :to_block_time
+    ) m
+    JOIN transactions t ON t.transaction_id = m.transaction_id
+    LEFT JOIN blocks b ON b.hash = t.accepting_block_hash""")
+
+_SYNC_CURSOR_BLOCK_TIME_QUERY = select(TxAddrMapping.block_time).filter(
+    TxAddrMapping.id == bindparam("cursor")
+)
+
+_TX_COUNT_FOR_ADDRESS_QUERY = select(func.count()).filter(
+    TxAddrMapping.address == bindparam("address")
+)
+
+_TX_COUNTER_FOR_ADDRESS_QUERY = select(AddressTxCount.count).filter(
+    AddressTxCount.address == bindparam("address")
+)
+
+_ADD_TX_COUNTS_QUERY = text("""
+    INSERT INTO address_tx_counts (address, count)
+    SELECT address, count(*) FROM tx_id_address_mapping
+    WHERE id > :watermark AND id <= :upper
+    GROUP BY address
+    ON CONFLICT (address) DO UPDATE SET count = address_tx_counts.count + EXCLUDED.count""")
+
+# only one server instance adds to the address counters at a time, see migrations
+_ADDRESS_TX_COUNTS_LOCK_ID = 7_263_002
+
+# max. tx_id_address_mapping id and the xmax of the snapshot it was read with
+_MAX_MAPPING_ID_QUERY = text("""
+    SELECT max(id) AS max_id,
+           CAST(pg_snapshot_xmax(pg_current_snapshot()) AS text) AS xmax,
+           CAST(pg_snapshot_xmin(pg_current_snapshot()) AS text) AS xmin
+    FROM tx_id_address_mapping""")
+
+# (max. mapping id, snapshot xmax) read by update_settled_mapping_id, not settled yet
+_mapping_id_observations = []
 
 
 class TransactionsReceivedAndSpent(BaseModel):
@@ -32,8 +106,38 @@ class TransactionForAddressResponse(BaseModel):
     transactions: List[TransactionsReceivedAndSpent]
 
 
+class AddressesSearch(BaseModel):
+    addresses: List[constr(regex=ADDRESS_REGEX)]
+
+
+class TxAddrMappingModel(BaseModel):
+    id: int
+    address: str
+    transaction_id: str
+    block_time: int | None
+
+
+class TxAcceptanceModel(BaseModel):
+    transaction_id: str
+    is_accepted: bool | None
+    accepting_block_hash: str | None
+    accepting_block_blue_score: int | None
+
+
+class AddressesSyncResponse(BaseModel):
+    cursor: int
+    hasMore: bool
+    mappings: List[TxAddrMappingModel]
+    transactions: List[TxModel]
+    acceptance: List[TxAcceptanceModel]
+    # block time range of the acceptance, not set for a full sync
+    acceptanceFrom: int | None
+    acceptanceTo: int | None
+
+
 class TransactionCount(BaseModel):
     total: int
+    last_updated: int = 1663286480803
 
 
 class PreviousOutpointLookupMode(str, Enum):
@@ -50,6 +154,7 @@ class PreviousOutpointLookupMode(str, Enum):
     deprecated=True,
 )
 @sql_db_only
+@statement_timeout(ADDRESS_STATEMENT_TIMEOUT)
 async def get_transactions_for_address(
     spectreAddress: str = Path(
         description="Spectre address as string e.g. "
@@ -99,6 +204,7 @@ async def get_transactions_for_address(
     tags=["Spectre addresses"],
 )
 @sql_db_only
+@statement_timeout(ADDRESS_STATEMENT_TIMEOUT)
 async def get_full_transactions_for_address(
     spectreAddress: str = Path(
         description="Spectre address as string e.g. "
@@ -116,30 +222,243 @@ async def get_full_transactions_for_address(
     resolve_previous_outpoints: PreviousOutpointLookupMode = Query(
         default="no", description=DESC_RESOLVE_PARAM
     ),
+    include_mempool: bool = Query(default=False, description=DESC_MEMPOOL_PARAM),
 ):
     """
     Get detailed transaction data for a Spectre address, with
     options to limit the number of results and include details of
-    previous transactions.
+    previous transactions. With `include_mempool`, the first page starts with the
+    pending transactions of the address.
     """
 
     async with async_session() as s:
         # Doing it this way as opposed to adding it directly in the IN clause
         # so I can re-use the same result in tx_list, TxInput and TxOutput
         tx_within_limit_offset = await s.execute(
-            select(TxAddrMapping.transaction_id)
-            .filter(TxAddrMapping.address == spectreAddress)
-            .limit(limit)
-            .offset(offset)
-            .order_by(TxAddrMapping.block_time.desc())
+            TX_IDS_FOR_ADDRESS_QUERY,
+            {"address": spectreAddress, "limit": limit, "offset": offset},
         )
 
         tx_ids_in_page = [x[0] for x in tx_within_limit_offset.all()]
 
-    return await search_for_transactions(
+    transactions = await search_for_transactions(
         TxSearch(transactionIds=tx_ids_in_page), fields, resolve_previous_outpoints
     )
 
+    if include_mempool and offset == 0:
+        pending = get_mempool_transactions_for_addresses([spectreAddress])
+        return _with_pending(transactions, pending, tx_ids_in_page, fields)
+
+    return transactions
+
+
+@app.post(
+    "/addresses/full-transactions",
+    response_model=List[TxModel],
+    response_model_exclude_unset=True,
+    tags=["Spectre addresses"],
+)
+@sql_db_only
+@statement_timeout(ADDRESS_STATEMENT_TIMEOUT)
+async def get_full_transactions_for_addresses(
+    addressesSearch: AddressesSearch,
+    response: Response,
+    limit: int = Query(
+        description="The number of records to get", ge=1, le=500, default=50
+    ),
+    cursor: str | None = Query(
+        default=None,
+        description="X-Next-Cursor header of the previous page",
+        regex=r"^(\d+|null):[a-f0-9]{64}$",
+    ),
+    fields: str = "",
+    resolve_previous_outpoints: PreviousOutpointLookupMode = Query(
+        default="no", description=DESC_RESOLVE_PARAM
+    ),
+    include_mempool: bool = Query(default=False, description=DESC_MEMPOOL_PARAM),
+):
+    """
+    Get the detailed transactions of several Spectre addresses (e.g. of a wallet) as one
+    timeline, newest first. Transactions of more than one address are returned once.
+    If there are more transactions, the `X-Next-Cursor` response header contains the
+    cursor for the next page. With `include_mempool`, the first page starts with the
+    pending transactions of the addresses.
+    """
+    if len(addressesSearch.addresses) > MAX_TIMELINE_ADDRESSES:
+        raise HTTPException(422, "Too many addresses")
+
+    # the first page starts before the transactions without block_time
+    block_time, transaction_id = "null", ""
+    if cursor:
+        block_time, transaction_id = cursor.split(":")
+
+    async with async_session() as s:
+        tx_ids_in_page = await s.execute(
+            TX_IDS_FOR_ADDRESSES_QUERY,
+            {
+                "addresses": list(set(addressesSearch.addresses)),
+                "null_block_time": block_time == "null",
+                "block_time": 2**63 - 1 if block_time == "null" else int(block_time),
+                "transaction_id": transaction_id,
+                "limit": limit,
+            },
+        )
+        tx_ids_in_page = tx_ids_in_page.all()
+
+    transactions = await search_for_transactions(
+        TxSearch(transactionIds=[x.transaction_id for x in tx_ids_in_page]),
+        fields,
+        resolve_previous_outpoints,
+    )
+
+    if len(tx_ids_in_page) == limit:
+        last = tx_ids_in_page[-1]
+        # the JSON query engine returns a StreamingResponse
+        headers = (
+            transactions if isinstance(transactions, Response) else response
+        ).headers
+        last_block_time = "null" if last.block_time is None else last.block_time
+        headers["X-Next-Cursor"] = f"{last_block_time}:{last.transaction_id}"
+
+    if include_mempool and not cursor:
+        pending = get_mempool_transactions_for_addresses(addressesSearch.addresses)
+        return _with_pending(
+            transactions,
+            pending,
+            [x.transaction_id for x in tx_ids_in_page],
+            fields,
+        )
+
+    return transactions
+
+
+def _with_pending(transactions, pending, transaction_ids, fields):
+    """
+    Puts the pending transactions, which are not in the database yet, before the
+    transactions of the database.
+    """
+    transaction_ids = set(transaction_ids)
+    pending = [
+        filter_fields(tx, fields)
+        for tx in pending
+        if tx["transaction_id"] not in transaction_ids
+    ]
+    if not pending:
+        return transactions
+
+    # the JSON query engine returns a StreamingResponse
+    if isinstance(transactions, StreamingResponse):
+        transactions.body_iterator = _prepend_json(pending, transactions.body_iterator)
+        return transactions
+
+    return [*pending, *transactions]
+
+
+async def _prepend_json(transactions, body):
+    prefix = "[" + ",".join(json.dumps(tx) for tx in transactions)
+    async for chunk in body:
+        if prefix:
+            # the first chunk is either "[]" or "[" with the first transactions
+            chunk = prefix + ("]" if chunk == "[]" else "," + chunk[1:])
+            prefix = None
+        yield chunk
+
+
+@app.post(
+    "/addresses/sync",
+    response_model=AddressesSyncResponse,
+    response_model_exclude_unset=True,
+    tags=["Spectre addresses"],
+)
+@sql_db_only
+@statement_timeout(ADDRESS_STATEMENT_TIMEOUT)
+async def sync_addresses(
+    addressesSearch: AddressesSearch,
+    cursor: int = Query(
+        default=0, ge=0, description="cursor of the previous sync, 0 for a full sync"
+    ),
+    limit: int = Query(
+        description="The number of mappings to get", ge=1, le=500, default=500
+    ),
+    fields: str = "",
+    resolve_previous_outpoints: PreviousOutpointLookupMode = Query(
+        default="no", description=DESC_RESOLVE_PARAM
+    ),
+):
+    """
+    Incremental sync of several Spectre addresses. Returns the address-transaction mappings
+    added since `cursor`, their transactions, the acceptance status of the addresses'
+    transactions shortly before the previous sync, and the new cursor.
+
+    Call again with the returned cursor, immediately while `hasMore` is true, otherwise when
+    polling. Mappings added during the last seconds may be returned again by the next sync.
+
+    `acceptance` covers only the transactions with a block time from `acceptanceFrom` to
+    `acceptanceTo` (ms, the SYNC_ACCEPTANCE_WINDOW before the cursor). Acceptance changes of
+    older transactions, e.g. by a deep reorg, are not reported, refetch these transactions.
+    """
+    if len(addressesSearch.addresses) > MAX_TIMELINE_ADDRESSES:
+        raise HTTPException(422, "Too many addresses")
+
+    if resolve_previous_outpoints in ["light", "full"] and limit > 50:
+        raise HTTPException(
+            422, "The limit is at most 50 for light and full previous outpoint lookups."
+        )
+
+    addresses = list(set(addressesSearch.addresses))
+
+    async with async_session() as s:
+        mappings = await s.execute(
+            MAPPINGS_FOR_ADDRESSES_QUERY,
+            {"addresses": addresses, "cursor": cursor, "limit": limit},
+        )
+        mappings = mappings.all()
+
+        # lower ids can't show up later, see update_settled_mapping_id
+        settled_id = await KeyValueStore.read(s, "settled_mapping_id")
+
+        acceptance = []
+        acceptance_window = {}
+        if cursor:
+            cursor_block_time = await s.execute(
+                _SYNC_CURSOR_BLOCK_TIME_QUERY, {"cursor": cursor}
+            )
+            cursor_block_time = cursor_block_time.scalar() or int(time.time() * 1000)
+            # newer transactions are returned with the mappings of this or later pages
+            acceptance_window = {
+                "acceptanceFrom": cursor_block_time - SYNC_ACCEPTANCE_WINDOW,
+                "acceptanceTo": cursor_block_time,
+            }
+            acceptance = await s.execute(
+                _ACCEPTANCE_FOR_ADDRESSES_QUERY,
+                {
+                    "addresses": addresses,
+                    "block_time": acceptance_window["acceptanceFrom"],
+                    "to_block_time": acceptance_window["acceptanceTo"],
+                },
+            )
+            acceptance = acceptance.all()
+
+    last_id = mappings[-1].id if mappings else cursor
+    new_cursor = cursor if settled_id is None else min(last_id, int(settled_id))
+    new_cursor = max(new_cursor, cursor)
+
+    transactions = await query_transactions(
+        list({m.transaction_id for m in mappings}),
+        fields.split(",") if fields else [],
+        resolve_previous_outpoints,
+    )
+
+    return {
+        "cursor": new_cursor,
+        # more settled mappings are available right now
+        "hasMore": len(mappings) == limit and new_cursor == last_id,
+        "mappings": [dict(m._mapping) for m in mappings],
+        "transactions": list(transactions),
+        "acceptance": [dict(a._mapping) for a in acceptance],
+        **acceptance_window,
+    }
+
 
 @app.get(
     "/addresses/{spectreAddress}/transactions-count",
@@ -147,6 +466,7 @@ async def get_full_transactions_for_address(
     tags=["Spectre addresses"],
 )
 @sql_db_only
+@statement_timeout(ADDRESS_STATEMENT_TIMEOUT)
 async def get_transaction_count_for_address(
     spectreAddress: str = Path(
         description="Spectre address as string e.g. "
@@ -157,13 +477,98 @@ async def get_transaction_count_for_address(
 ):
     """
     Get total number of transactions associated with the specified Spectre address.
+    `last_updated` is the time (ms) the count was last refreshed.
     """
+    counters = WorkerSnapshot.get("address_tx_counts")
 
     async with async_session() as s:
-        count_query = select(func.count()).filter(
-            TxAddrMapping.address == spectreAddress
+        if counters:
+            tx_count = await s.execute(
+                _TX_COUNTER_FOR_ADDRESS_QUERY, {"address": spectreAddress}
+            )
+            tx_count = tx_count.scalar()
+            if tx_count is not None:
+                return TransactionCount(
+                    total=tx_count, last_updated=counters["updated"]
+                )
+
+        # exact count while the counters are incomplete or the address isn't counted yet
+        tx_count = await s.execute(
+            _TX_COUNT_FOR_ADDRESS_QUERY, {"address": spectreAddress}
         )
 
-        tx_count = await s.execute(count_query)
+    return TransactionCount(
+        total=tx_count.scalar(), last_updated=int(time.time() * 1000)
+    )
+
+
+@app.on_event("startup")
+@repeat_every(seconds=10)
+async def update_settled_mapping_id():
+    """
+    Stores a tx_id_address_mapping id as settled_mapping_id, once all transactions, which
+    were running when it was the highest id, have ended. Rows with lower ids can't be
+    committed later. A read replica returns the value only after these rows.
+    """
+    if not IS_SQL_DB_CONFIGURED or not WorkerSnapshot.is_leader():
+        return
+
+    async with async_session_primary() as s:
+        observation = (await s.execute(_MAX_MAPPING_ID_QUERY)).one()
+        xmin = int(observation.xmin)
+
+        settled_id = None
+        while _mapping_id_observations and _mapping_id_observations[0][1] <= xmin:
+            settled_id = _mapping_id_observations.pop(0)[0]
+        _mapping_id_observations.append(
+            (observation.max_id or 0, int(observation.xmax))
+        )
+        if settled_id is None:
+            return
+
+        # other server instances may store a lower id
+        await KeyValueStore.upsert(
+            s,
+            "settled_mapping_id",
+            str(settled_id),
+            where=cast(KeyValueModel.value, BigInteger) < settled_id,
+        )
+        await s.commit()
+
+
+async def _add_tx_counts(s, watermark, upper):
+    await s.execute(_ADD_TX_COUNTS_QUERY, {"watermark": watermark, "upper": upper})
+
+
+@app.on_event("startup")
+@repeat_every(seconds=10)
+@statement_timeout(0)
+async def update_address_tx_counts():
+    """
+    Adds the tx_id_address_mapping rows above the watermark up to the settled id to
+    address_tx_counts. Each batch holds an advisory lock, other server instances skip
+    the run meanwhile.
+    """
+    if not IS_SQL_DB_CONFIGURED or not WorkerSnapshot.is_leader():
+        return
+
+    async with async_session_primary() as s:
+        settled_id = await KeyValueStore.read(s, "settled_mapping_id")
+        await s.commit()
+        if settled_id is None:
+            return
+        settled_id = int(settled_id)
+
+        watermark = await KeyValueStore.advance_watermark(
+            s,
+            "address_tx_counts_watermark",
+            settled_id,
+            ADDRESS_TX_COUNT_BATCH,
+            _add_tx_counts,
+            lock_id=_ADDRESS_TX_COUNTS_LOCK_ID,
+        )
+        if watermark is None:
+            return
 
-    return TransactionCount(total=tx_count.scalar())
+    # counters are complete up to the settled id
+    WorkerSnapshot.publish("address_tx_counts", {"updated": int(time.time() * 1000)})
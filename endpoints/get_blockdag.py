@@ -1,8 +1,10 @@
 # encoding: utf-8
 from typing import List
 
+from fastapi_utils.tasks import repeat_every
 from pydantic import BaseModel
 
+from helper import WorkerSnapshot
 from server import app, spectred_client
 
 
@@ -33,3 +35,24 @@ async def get_blockdag():
     """
     resp = await spectred_client.request("getBlockDagInfoRequest")
     return resp["getBlockDagInfoResponse"]
+
+
+async def get_blockdag_info():
+    """
+    Returns the BlockDAG info last polled by the leader worker, or requests it from spectred
+    if no snapshot is available (single worker or not polled yet).
+    """
+    blockdag_info = WorkerSnapshot.get("blockdag")
+    if blockdag_info is None:
+        resp = await spectred_client.request("getBlockDagInfoRequest")
+        blockdag_info = resp["getBlockDagInfoResponse"]
+    return blockdag_info
+
+
+@app.on_event("startup")
+@repeat_every(seconds=5)
+async def update_blockdag_info():
+    # with a single worker there is nothing to share, it is requested when needed
+    if WorkerSnapshot.MULTI_WORKER and WorkerSnapshot.is_leader():
+        resp = await spectred_client.request("getBlockDagInfoRequest")
+        WorkerSnapshot.publish("blockdag", resp["getBlockDagInfoResponse"])
@@ -2,8 +2,9 @@
 
 from pydantic import BaseModel
 
+from endpoints.get_blockdag import get_blockdag_info
 from helper.deflationary_table import DEFLATIONARY_TABLE
-from server import app, spectred_client
+from server import app
 
 
 class BlockRewardResponse(BaseModel):
@@ -19,8 +20,7 @@ async def get_blockreward(stringOnly: bool = False):
     """
     Returns the current blockreward in SPR/block.
     """
-    resp = await spectred_client.request("getBlockDagInfoRequest")
-    daa_score = int(resp["getBlockDagInfoResponse"]["virtualDaaScore"])
+    daa_score = int((await get_blockdag_info())["virtualDaaScore"])
 
     reward = 0
 
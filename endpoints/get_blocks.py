@@ -1,20 +1,109 @@
 # encoding: utf-8
+import json
 import os
+from collections import defaultdict
 from typing import List
 
 from fastapi import Query, Path, HTTPException
 from fastapi import Response
+from fastapi_utils.tasks import repeat_every
 from pydantic import BaseModel
-from sqlalchemy import select
-
-from dbsession import async_session
+from sqlalchemy import String, any_, bindparam, func, select, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+
+from dbsession import async_session, async_session_primary
+from endpoints import (
+    PROTOBUF_MEDIA_TYPE,
+    PROTOBUF_RESPONSE,
+    accepts_protobuf,
+    statement_timeout,
+)
 from endpoints.get_virtual_chain_blue_score import current_blue_score_data
+from helper import KeyValueStore, WorkerSnapshot
 from helper.difficulty_calculation import bits_to_difficulty
 from models.Block import Block
+from models.BlockTransaction import BlockTransaction
 from models.Transaction import Transaction, TransactionOutput, TransactionInput
+from queries.blocks import BLOCKS_BY_BLUE_SCORE_RANGE_QUERY
 from server import app, spectred_client
+from spectred.message_to_dict import message_to_dict
 
 IS_SQL_DB_CONFIGURED = os.getenv("SQL_URI") is not None
+BLOCKS_STATEMENT_TIMEOUT = int(os.getenv("SQL_STATEMENT_TIMEOUT_BLOCKS", "10000"))
+BLOCKS_RANGE_MAX_LIMIT = int(os.getenv("BLOCKS_RANGE_MAX_LIMIT", "500"))
+# maintain the block_transactions table and use it for block transaction lookups
+BLOCK_TRANSACTIONS_TABLE = os.getenv("BLOCK_TRANSACTIONS_TABLE") == "true"
+# max. blue scores added to block_transactions per statement
+BLOCK_TRANSACTIONS_BATCH = int(os.getenv("BLOCK_TRANSACTIONS_BATCH", "10000"))
+# blue scores below the watermark re-scanned by each update for late transactions
+BLOCK_TRANSACTIONS_RESCAN = int(os.getenv("BLOCK_TRANSACTIONS_RESCAN", "600"))
+
+_MAX_BLUE_SCORE = 2**63 - 1
+
+_BLOCK_QUERY = select(Block).where(Block.hash == bindparam("hash")).limit(1)
+_BLOCKS_BY_BLUE_SCORE_QUERY = select(Block).where(
+    Block.blue_score == bindparam("blue_score")
+)
+# only the columns of the block response, rows instead of ORM objects
+_BLOCKS_TRANSACTIONS_QUERY = select(
+    Transaction.transaction_id,
+    Transaction.subnetwork_id,
+    Transaction.hash,
+    Transaction.mass,
+    Transaction.block_hash,
+    Transaction.block_time,
+).filter(Transaction.block_hash.overlap(bindparam("block_hashes", type_=ARRAY(String))))
+_MAPPED_BLOCKS_TRANSACTIONS_QUERY = (
+    select(
+        BlockTransaction.block_hash.label("mapped_block_hash"),
+        Transaction.transaction_id,
+        Transaction.subnetwork_id,
+        Transaction.hash,
+        Transaction.mass,
+        Transaction.block_hash,
+        Transaction.block_time,
+    )
+    .join(Transaction, Transaction.transaction_id == BlockTransaction.transaction_id)
+    .where(
+        BlockTransaction.block_hash
+        == any_(bindparam("block_hashes", type_=ARRAY(String)))
+    )
+    .order_by(BlockTransaction.block_hash, BlockTransaction.position)
+)
+_TRANSACTION_IDS = bindparam("transaction_ids", type_=ARRAY(String))
+_OUTPUTS_QUERY = select(
+    TransactionOutput.transaction_id,
+    TransactionOutput.amount,
+    TransactionOutput.script_public_key,
+    TransactionOutput.script_public_key_type,
+    TransactionOutput.script_public_key_address,
+).where(TransactionOutput.transaction_id == any_(_TRANSACTION_IDS))
+_INPUTS_QUERY = select(
+    TransactionInput.transaction_id,
+    TransactionInput.previous_outpoint_hash,
+    TransactionInput.previous_outpoint_index,
+    TransactionInput.signature_script,
+    TransactionInput.sig_op_count,
+).where(TransactionInput.transaction_id == any_(_TRANSACTION_IDS))
+
+_ADD_BLOCK_TRANSACTIONS_QUERY = text("""
+    INSERT INTO block_transactions (block_hash, transaction_id, position)
+    SELECT b.hash, t.transaction_id,
+           row_number() OVER (
+               PARTITION BY b.hash
+               ORDER BY t.subnetwork_id <> '0100000000000000000000000000000000000000',
+                        t.subnetwork_id, t.transaction_id
+           ) - 1
+    FROM blocks b
+    JOIN transactions t ON t.block_hash @> ARRAY[b.hash]
+    WHERE b.blue_score > :watermark AND b.blue_score <= :upper
+    ON CONFLICT (block_hash, transaction_id) DO UPDATE SET position = EXCLUDED.position
+    WHERE block_transactions.position IS DISTINCT FROM EXCLUDED.position""")
+
+# highest blue score seen by the previous block_transactions update
+_previous_max_blue_score = None
 
 
 class VerboseDataModel(BaseModel):
@@ -78,15 +167,58 @@ class BlockResponse(BaseModel):
     blocks: List[BlockModel] | None
 
 
-@app.get("/blocks/{blockId}", response_model=BlockModel, tags=["Spectre blocks"])
-async def get_block(response: Response, blockId: str = Path(regex="[a-f0-9]{64}")):
+def _block_cache_control(blue_score: int):
+    if blue_score > current_blue_score_data["blue_score"] - 20:
+        return "public, max-age=1"
+    elif blue_score > current_blue_score_data["blue_score"] - 60:
+        return "public, max-age=10"
+    else:
+        return "public, max-age=600"
+
+
+@app.get(
+    "/blocks/{blockId}",
+    response_model=BlockModel,
+    tags=["Spectre blocks"],
+    responses=PROTOBUF_RESPONSE,
+)
+@statement_timeout(BLOCKS_STATEMENT_TIMEOUT)
+async def get_block(
+    request: Request, response: Response, blockId: str = Path(regex="[a-f0-9]{64}")
+):
     """
     Retrieves detailed block data for a specified block hash (blockId) from the Spectre blockDAG.
     Attempts to fetch the block details from the Spectred node. If unavailable, fetches from the database as a fallback.
+
+    Send `Accept: application/x-protobuf` to receive the serialized `GetBlockResponseMessage`
+    from Spectred instead of JSON. Blocks which are only available in the database are always returned as JSON.
     """
-    resp = await spectred_client.request(
-        "getBlockRequest", params={"hash": blockId, "includeTransactions": True}
-    )
+    response.headers["Vary"] = "Accept"
+
+    if accepts_protobuf(request):
+        resp = await spectred_client.request(
+            "getBlockRequest",
+            params={"hash": blockId, "includeTransactions": True},
+            raw=True,
+        )
+        block_resp = resp.getBlockResponse
+        if block_resp.HasField("block") and block_resp.block.transactions:
+            return Response(
+                content=block_resp.SerializeToString(),
+                media_type=PROTOBUF_MEDIA_TYPE,
+                headers={
+                    "Cache-Control": _block_cache_control(
+                        block_resp.block.header.blueScore
+                    ),
+                    "Vary": "Accept",
+                },
+            )
+        # not available as a complete block in spectred, continue with JSON
+        resp = message_to_dict(resp)
+    else:
+        resp = await spectred_client.request(
+            "getBlockRequest", params={"hash": blockId, "includeTransactions": True}
+        )
     requested_block = None
 
     if "block" in resp["getBlockResponse"]:
@@ -112,20 +244,9 @@ async def get_block(response: Response, blockId: str = Path(regex="[a-f0-9]{64}"
     if "transactions" not in requested_block or not requested_block["transactions"]:
         requested_block["transactions"] = await get_block_transactions(blockId)
 
-    if (
-        int(requested_block["header"]["blueScore"])
-        > current_blue_score_data["blue_score"] - 20
-    ):
-        response.headers["Cache-Control"] = "public, max-age=1"
-
-    elif (
+    response.headers["Cache-Control"] = _block_cache_control(
         int(requested_block["header"]["blueScore"])
-        > current_blue_score_data["blue_score"] - 60
-    ):
-        response.headers["Cache-Control"] = "public, max-age=10"
-
-    else:
-        response.headers["Cache-Control"] = "public, max-age=600"
+    )
 
     return requested_block
 
@@ -161,64 +282,158 @@ async def get_blocks(
 @app.get(
     "/blocks-from-bluescore", response_model=List[BlockModel], tags=["Spectre blocks"]
 )
+@statement_timeout(BLOCKS_STATEMENT_TIMEOUT)
 async def get_blocks_from_bluescore(
-    response: Response, blueScore: int = 43679173, includeTransactions: bool = False
+    response: Response,
+    blueScore: int = 43679173,
+    includeTransactions: bool = False,
+    from_: int | None = Query(
+        default=None, alias="from", description="First blue score of a range"
+    ),
+    to: int | None = Query(default=None, description="Last blue score of a range"),
+    limit: int = Query(default=100, ge=1, le=BLOCKS_RANGE_MAX_LIMIT),
 ):
     """
     Lists blocks beginning from a specified bluescore within the Spectre blockDAG.
+
+    Use `from` (and optionally `to`) instead of `blueScore` to list the blocks of a blue score
+    range ordered by blue score, at most `limit` blocks. If the limit is reached, only complete
+    blue scores are returned, so the next page starts at the last returned blue score + 1.
     """
     response.headers["X-Data-Source"] = "Database"
 
-    if blueScore > current_blue_score_data["blue_score"] - 20:
-        response.headers["Cache-Control"] = "no-store"
+    if from_ is None:
+        if blueScore > current_blue_score_data["blue_score"] - 20:
+            response.headers["Cache-Control"] = "no-store"
 
-    blocks = await get_blocks_from_db_by_bluescore(blueScore)
-
-    return [
-        {
-            "header": {
-                "version": block.version,
-                "hashMerkleRoot": block.hash_merkle_root,
-                "acceptedIdMerkleRoot": block.accepted_id_merkle_root,
-                "utxoCommitment": block.utxo_commitment,
-                "timestamp": round(block.timestamp.timestamp() * 1000),
-                "bits": block.bits,
-                "nonce": block.nonce,
-                "daaScore": block.daa_score,
-                "blueWork": block.blue_work,
-                "parents": [{"parentHashes": block.parents}] if block.parents else [],
-                "blueScore": block.blue_score,
-                "pruningPoint": block.pruning_point,
-            },
-            "transactions": (txs := (await get_block_transactions(block.hash)))
+        blocks = await get_blocks_from_db_by_bluescore(blueScore)
+        transactions = (
+            await get_blocks_transactions([block.hash for block in blocks])
             if includeTransactions
+            else {}
+        )
+        return [_block_to_dict(block, transactions.get(block.hash)) for block in blocks]
+
+    if to is not None and to < from_:
+        raise HTTPException(422, "'to' must not be lower than 'from'")
+
+    blocks = await get_blocks_from_db_by_bluescore_range(from_, to, limit)
+    transactions = (
+        await get_blocks_transactions([block.hash for block in blocks])
+        if includeTransactions
+        else {}
+    )
+
+    headers = {"X-Data-Source": "Database"}
+    if to is None or to > current_blue_score_data["blue_score"] - 20:
+        headers["Cache-Control"] = "no-store"
+
+    return StreamingResponse(
+        _stream_blocks(blocks, transactions),
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+def _block_to_dict(block, transactions):
+    """
+    Returns the BlockModel dict of a block from the database. transactions is None, if
+    they are not requested.
+    """
+    return {
+        "header": {
+            "version": block.version,
+            "hashMerkleRoot": block.hash_merkle_root,
+            "acceptedIdMerkleRoot": block.accepted_id_merkle_root,
+            "utxoCommitment": block.utxo_commitment,
+            "timestamp": str(round(block.timestamp.timestamp() * 1000)),
+            "bits": block.bits,
+            "nonce": block.nonce,
+            "daaScore": str(block.daa_score),
+            "blueWork": block.blue_work,
+            "parents": [{"parentHashes": block.parents}] if block.parents else [],
+            "blueScore": str(block.blue_score),
+            "pruningPoint": block.pruning_point,
+        },
+        "transactions": transactions,
+        "verboseData": {
+            "hash": block.hash,
+            "difficulty": bits_to_difficulty(block.bits),
+            "selectedParentHash": block.selected_parent_hash,
+            "transactionIds": [
+                tx["verboseData"]["transactionId"] for tx in transactions
+            ]
+            if transactions is not None
             else None,
-            "verboseData": {
-                "hash": block.hash,
-                "difficulty": bits_to_difficulty(block.bits),
-                "selectedParentHash": block.selected_parent_hash,
-                "transactionIds": [tx["verboseData"]["transactionId"] for tx in txs]
-                if includeTransactions
-                else None,
-                "blueScore": block.blue_score,
-                "childrenHashes": None,
-                "mergeSetBluesHashes": block.merge_set_blues_hashes or [],
-                "mergeSetRedsHashes": block.merge_set_reds_hashes or [],
-                "isChainBlock": None,
-            },
-        }
-        for block in blocks
-    ]
+            "blueScore": str(block.blue_score),
+            "childrenHashes": None,
+            "mergeSetBluesHashes": block.merge_set_blues_hashes or [],
+            "mergeSetRedsHashes": block.merge_set_reds_hashes or [],
+            "isChainBlock": None,
+        },
+    }
+
+
+async def _stream_blocks(blocks, transactions):
+    """
+    Yields the blocks as JSON array. The data is already loaded, only the encoding is streamed.
+    """
+    yield "["
+    separator = ""
+    for block in blocks:
+        yield separator + json.dumps(
+            _block_to_dict(block, transactions.get(block.hash)),
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        separator = ","
+    yield "]"
 
 
 async def get_blocks_from_db_by_bluescore(blue_score):
     async with async_session() as s:
         blocks = (
-            (await s.execute(select(Block).where(Block.blue_score == blue_score)))
+            (await s.execute(_BLOCKS_BY_BLUE_SCORE_QUERY, {"blue_score": blue_score}))
+            .scalars()
+            .all()
+        )
+
+    return blocks
+
+
+async def get_blocks_from_db_by_bluescore_range(from_blue_score, to_blue_score, limit):
+    """
+    Retrieves at most limit blocks from from_blue_score to to_blue_score (None = open end).
+    A blue score cut by the limit is dropped. If it is the only one, there is no complete
+    page within the limit.
+    """
+    async with async_session() as s:
+        blocks = (
+            (
+                await s.execute(
+                    BLOCKS_BY_BLUE_SCORE_RANGE_QUERY,
+                    {
+                        "from_blue_score": from_blue_score,
+                        "to_blue_score": _MAX_BLUE_SCORE
+                        if to_blue_score is None
+                        else to_blue_score,
+                        "limit": limit + 1,
+                    },
+                )
+            )
             .scalars()
             .all()
         )
 
+    if len(blocks) > limit:
+        last_blue_score = blocks[limit].blue_score
+        blocks = [b for b in blocks[:limit] if b.blue_score != last_blue_score]
+        if not blocks:
+            raise HTTPException(
+                422,
+                f"Blue score {last_blue_score} has more blocks than the limit {limit}",
+            )
+
     return blocks
 
 
@@ -227,9 +442,7 @@ async def get_block_from_db(blockId):
     Retrieves a block from the database based on a given block ID.
     """
     async with async_session() as s:
-        requested_block = await s.execute(
-            select(Block).where(Block.hash == blockId).limit(1)
-        )
+        requested_block = await s.execute(_BLOCK_QUERY, {"hash": blockId})
 
         try:
             requested_block = requested_block.first()[0]  # type: Block
@@ -278,65 +491,81 @@ async def get_block_transactions(blockId):
     """
     Retrieves transactions associated with a specified block.
     """
-    # create tx data
-    tx_list = []
+    return (await get_blocks_transactions([blockId]))[blockId]
 
-    async with async_session() as s:
-        transactions = await s.execute(
-            select(Transaction).filter(Transaction.block_hash.contains([blockId]))
-        )
 
-        transactions = transactions.scalars().all()
+async def get_blocks_transactions(block_hashes):
+    """
+    Retrieves the transactions of several blocks with one query each for transactions,
+    outputs and inputs. Returns a dict block hash -> list of transactions.
+    """
+    # (block hash, transaction row)
+    block_transactions = []
+    unmapped_hashes = set(block_hashes)
 
-        tx_outputs = await s.execute(
-            select(TransactionOutput).where(
-                TransactionOutput.transaction_id.in_(
-                    [tx.transaction_id for tx in transactions]
-                )
+    async with async_session() as s:
+        if BLOCK_TRANSACTIONS_TABLE and WorkerSnapshot.get("block_transactions"):
+            mapped = await s.execute(
+                _MAPPED_BLOCKS_TRANSACTIONS_QUERY, {"block_hashes": block_hashes}
             )
-        )
-
-        tx_outputs = tx_outputs.scalars().all()
+            block_transactions = [(tx.mapped_block_hash, tx) for tx in mapped]
+            # each block has a coinbase transaction, blocks without rows are not mapped yet
+            unmapped_hashes -= {block_hash for block_hash, _ in block_transactions}
 
-        tx_inputs = await s.execute(
-            select(TransactionInput).where(
-                TransactionInput.transaction_id.in_(
-                    [tx.transaction_id for tx in transactions]
-                )
+        if unmapped_hashes:
+            transactions = await s.execute(
+                _BLOCKS_TRANSACTIONS_QUERY, {"block_hashes": list(unmapped_hashes)}
             )
+            # a transaction may be included in several of the requested blocks
+            block_transactions += [
+                (block_hash, tx)
+                for tx in transactions
+                for block_hash in tx.block_hash
+                if block_hash in unmapped_hashes
+            ]
+
+        transaction_ids = list({tx.transaction_id for _, tx in block_transactions})
+
+        tx_outputs = (
+            await s.execute(_OUTPUTS_QUERY, {"transaction_ids": transaction_ids})
+        ).all()
+
+        tx_inputs = (
+            await s.execute(_INPUTS_QUERY, {"transaction_ids": transaction_ids})
+        ).all()
+
+    tx_inputs_by_id = defaultdict(list)
+    for tx_inp in tx_inputs:
+        tx_inputs_by_id[tx_inp.transaction_id].append(
+            {
+                "previousOutpoint": {
+                    "transactionId": tx_inp.previous_outpoint_hash,
+                    "index": tx_inp.previous_outpoint_index,
+                },
+                "signatureScript": tx_inp.signature_script,
+                "sigOpCount": tx_inp.sig_op_count,
+            }
         )
 
-        tx_inputs = tx_inputs.scalars().all()
+    tx_outputs_by_id = defaultdict(list)
+    for tx_out in tx_outputs:
+        tx_outputs_by_id[tx_out.transaction_id].append(
+            {
+                "amount": tx_out.amount,
+                "scriptPublicKey": {"scriptPublicKey": tx_out.script_public_key},
+                "verboseData": {
+                    "scriptPublicKeyType": tx_out.script_public_key_type,
+                    "scriptPublicKeyAddress": tx_out.script_public_key_address,
+                },
+            }
+        )
 
-    for tx in transactions:
-        tx_list.append(
+    tx_lists = {block_hash: [] for block_hash in block_hashes}
+    for block_hash, tx in block_transactions:
+        tx_lists[block_hash].append(
             {
-                "inputs": [
-                    {
-                        "previousOutpoint": {
-                            "transactionId": tx_inp.previous_outpoint_hash,
-                            "index": tx_inp.previous_outpoint_index,
-                        },
-                        "signatureScript": tx_inp.signature_script,
-                        "sigOpCount": tx_inp.sig_op_count,
-                    }
-                    for tx_inp in tx_inputs
-                    if tx_inp.transaction_id == tx.transaction_id
-                ],
-                "outputs": [
-                    {
-                        "amount": tx_out.amount,
-                        "scriptPublicKey": {
-                            "scriptPublicKey": tx_out.script_public_key
-                        },
-                        "verboseData": {
-                            "scriptPublicKeyType": tx_out.script_public_key_type,
-                            "scriptPublicKeyAddress": tx_out.script_public_key_address,
-                        },
-                    }
-                    for tx_out in tx_outputs
-                    if tx_out.transaction_id == tx.transaction_id
-                ],
+                "inputs": tx_inputs_by_id[tx.transaction_id],
+                "outputs": tx_outputs_by_id[tx.transaction_id],
                 "subnetworkId": tx.subnetwork_id,
                 "verboseData": {
                     "transactionId": tx.transaction_id,
@@ -348,4 +577,63 @@ async def get_block_transactions(blockId):
             }
         )
 
-    return tx_list
+    return tx_lists
+
+
+async def _add_block_transactions(s, watermark, upper):
+    await s.execute(
+        _ADD_BLOCK_TRANSACTIONS_QUERY, {"watermark": watermark, "upper": upper}
+    )
+
+
+@app.on_event("startup")
+@repeat_every(seconds=10)
+@statement_timeout(0)
+async def update_block_transactions():
+    """
+    Adds the transactions of the blocks above the blue score watermark to
+    block_transactions. Only blue scores seen by the previous run are added, so
+    transactions inserted a bit later than their block are not skipped. The last
+    BLOCK_TRANSACTIONS_RESCAN blue scores below the watermark are added again, for
+    transactions inserted even later.
+    """
+    global _previous_max_blue_score
+
+    if (
+        not IS_SQL_DB_CONFIGURED
+        or not BLOCK_TRANSACTIONS_TABLE
+        or not WorkerSnapshot.is_leader()
+    ):
+        return
+
+    async with async_session_primary() as s:
+        max_blue_score = await s.execute(select(func.max(Block.blue_score)))
+        max_blue_score = max_blue_score.scalar() or 0
+
+        settled_blue_score, _previous_max_blue_score = (
+            _previous_max_blue_score,
+            max_blue_score,
+        )
+        if settled_blue_score is None:
+            return
+
+        watermark = await KeyValueStore.read(s, "block_transactions_watermark")
+        if watermark is not None:
+            # only new rows and changed positions are written
+            watermark = int(watermark)
+            await _add_block_transactions(
+                s, max(watermark - BLOCK_TRANSACTIONS_RESCAN, -1), watermark
+            )
+            await s.commit()
+
+        watermark = await KeyValueStore.advance_watermark(
+            s,
+            "block_transactions_watermark",
+            settled_blue_score,
+            BLOCK_TRANSACTIONS_BATCH,
+            _add_block_transactions,
+            # genesis has blue score 0
+            start=-1,
+        )
+
+    WorkerSnapshot.publish("block_transactions", {"blue_score": watermark})
@@ -1,7 +1,9 @@
 # encoding: utf-8
 
+from fastapi_utils.tasks import repeat_every
 from pydantic import BaseModel
 
+from helper import WorkerSnapshot
 from server import app, spectred_client
 from fastapi.responses import PlainTextResponse
 
@@ -67,3 +69,24 @@ async def get_max_coins():
     """
     resp = await spectred_client.request("getCoinSupplyRequest")
     return str(float(resp["getCoinSupplyResponse"]["maxSompi"]) / 1e8)
+
+
+async def get_coin_supply():
+    """
+    Returns the coin supply last polled by the leader worker, or requests it from spectred
+    if no snapshot is available (single worker or not polled yet).
+    """
+    coin_supply = WorkerSnapshot.get("coinsupply")
+    if coin_supply is None:
+        resp = await spectred_client.request("getCoinSupplyRequest")
+        coin_supply = resp["getCoinSupplyResponse"]
+    return coin_supply
+
+
+@app.on_event("startup")
+@repeat_every(seconds=5)
+async def update_coin_supply():
+    # with a single worker there is nothing to share, it is requested when needed
+    if WorkerSnapshot.MULTI_WORKER and WorkerSnapshot.is_leader():
+        resp = await spectred_client.request("getCoinSupplyRequest")
+        WorkerSnapshot.publish("coinsupply", resp["getCoinSupplyResponse"])
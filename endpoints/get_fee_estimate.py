@@ -1,10 +1,31 @@
 # encoding: utf-8
+import os
+import time
 
 from fastapi import HTTPException
+from fastapi_utils.tasks import repeat_every
 from typing import List
+
+from helper import WorkerSnapshot
 from server import app, spectred_client
 from pydantic import BaseModel
 
+FEE_ESTIMATE_POLL_INTERVAL = float(os.getenv("FEE_ESTIMATE_POLL_INTERVAL", "2"))
+# an older estimate is not served, the node is probably not reachable
+FEE_ESTIMATE_MAX_AGE = float(
+    os.getenv("FEE_ESTIMATE_MAX_AGE", str(5 * FEE_ESTIMATE_POLL_INTERVAL))
+)
+
+# updated: time.time() of the poll
+current_fee_estimate = {"estimate": None, "updated": None}
+
+
+def _set_fee_estimate(value):
+    current_fee_estimate.update(value)
+
+
+WorkerSnapshot.subscribe("fee_estimate", _set_fee_estimate)
+
 
 class FeeEstimateBucket(BaseModel):
     feerate: int = 1
@@ -28,11 +49,50 @@ async def get_fee_estimate():
 
     For all buckets, feerate values represent fee/mass of a transaction in `sompi/gram` units.<br>
     Given a feerate value recommendation, calculate the required fee by
-    taking the transaction mass and multiplying it by feerate: `fee = feerate * mass(tx)`
+    taking the transaction mass and multiplying it by feerate: `fee = feerate * mass(tx)`<br>
+    The estimate is refreshed every few seconds.
     """
-    resp = await spectred_client.request("getFeeEstimateRequest")
-    if resp is None:
-        raise HTTPException(
-            status_code=501, detail="Spectred does not support fee estimate"
+    return await get_cached_fee_estimate()
+
+
+async def get_cached_fee_estimate():
+    """
+    Returns the fee estimate polled by update_fee_estimate. The node is only asked, if
+    there is no estimate yet or it is older than FEE_ESTIMATE_MAX_AGE.
+    """
+    if current_fee_estimate["estimate"] is None:
+        _set_fee_estimate(
+            {"estimate": await _request_fee_estimate(), "updated": time.time()}
         )
-    return resp["getFeeEstimateResponse"]["estimate"]
+        if current_fee_estimate["estimate"] is None:
+            raise HTTPException(
+                status_code=501, detail="Spectred does not support fee estimate"
+            )
+    elif time.time() - current_fee_estimate["updated"] > FEE_ESTIMATE_MAX_AGE:
+        try:
+            estimate = await _request_fee_estimate()
+        except Exception:
+            estimate = None
+        if estimate is None:
+            raise HTTPException(status_code=503, detail="Fee estimate is outdated")
+        _set_fee_estimate({"estimate": estimate, "updated": time.time()})
+
+    return current_fee_estimate["estimate"]
+
+
+async def _request_fee_estimate():
+    resp = await spectred_client.request("getFeeEstimateRequest")
+    return resp["getFeeEstimateResponse"]["estimate"] if resp else None
+
+
+@app.on_event("startup")
+@repeat_every(seconds=FEE_ESTIMATE_POLL_INTERVAL)
+async def update_fee_estimate():
+    if not WorkerSnapshot.is_leader():
+        return
+
+    estimate = await _request_fee_estimate()
+    if estimate is not None:
+        value = {"estimate": estimate, "updated": time.time()}
+        _set_fee_estimate(value)
+        WorkerSnapshot.publish("fee_estimate", value)
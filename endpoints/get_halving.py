@@ -5,8 +5,9 @@ from datetime import datetime
 from pydantic import BaseModel
 from starlette.responses import PlainTextResponse
 
+from endpoints.get_blockdag import get_blockdag_info
 from helper.deflationary_table import DEFLATIONARY_TABLE
-from server import app, spectred_client
+from server import app
 
 
 class HalvingResponse(BaseModel):
@@ -22,8 +23,7 @@ async def get_halving(field: str | None = None):
     """
     Returns information about bi-annual halving with monthly reduction.
     """
-    resp = await spectred_client.request("getBlockDagInfoRequest")
-    daa_score = int(resp["getBlockDagInfoResponse"]["virtualDaaScore"])
+    daa_score = int((await get_blockdag_info())["virtualDaaScore"])
 
     future_reward = 0
     daa_breakpoint = 0
@@ -1,17 +1,53 @@
 # encoding: utf-8
-import json
+import os
+import time
+from enum import Enum
+from typing import List
 
+from fastapi import HTTPException, Query
+from fastapi_utils.tasks import repeat_every
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import func, select, text
 
-from dbsession import async_session
-from endpoints import sql_db_only
-from helper import KeyValueStore
+from dbsession import async_session, async_session_primary
+from endpoints import sql_db_only, statement_timeout
+from endpoints.get_blockdag import get_blockdag_info
+from helper import KeyValueStore, WorkerSnapshot
 from helper.difficulty_calculation import bits_to_difficulty
 from models.Block import Block
-from server import app, spectred_client
-
-MAXHASH_CACHE = (0, 0)
+from models.HashrateHistory import HashrateHistory
+from server import app
+
+IS_SQL_DB_CONFIGURED = os.getenv("SQL_URI") is not None
+# max. blue scores added to the hashrate history per statement
+HASHRATE_HISTORY_BATCH = int(os.getenv("HASHRATE_HISTORY_BATCH", "100000"))
+# max. number of periods returned by /info/hashrate/history
+HASHRATE_HISTORY_MAX_PERIODS = 5000
+
+_RESOLUTION_MS = {"hour": 3_600_000, "day": 86_400_000}
+
+_ADD_HASHRATE_HISTORY_QUERY = text("""
+    INSERT INTO hashrate_history
+        (resolution, bucket, bits, block_hash, blue_score, daa_score, timestamp)
+    SELECT DISTINCT ON (bucket)
+        CAST(:resolution AS text), bucket, bits, hash, blue_score, daa_score, timestamp
+    FROM (
+        SELECT (extract(epoch FROM date_trunc(:resolution, timestamp)) * 1000)::bigint AS bucket,
+               bits, hash, blue_score, daa_score, timestamp
+        FROM blocks
+        WHERE blue_score > :watermark AND blue_score <= :upper
+    ) b
+    ORDER BY bucket, bits
+    ON CONFLICT (resolution, bucket) DO UPDATE SET
+        bits = EXCLUDED.bits,
+        block_hash = EXCLUDED.block_hash,
+        blue_score = EXCLUDED.blue_score,
+        daa_score = EXCLUDED.daa_score,
+        timestamp = EXCLUDED.timestamp
+    WHERE EXCLUDED.bits < hashrate_history.bits""")
+
+# highest blue score seen by the previous hashrate history update
+_previous_max_blue_score = None
 
 
 class BlockHeader(BaseModel):
@@ -31,6 +67,18 @@ class MaxHashrateResponse(BaseModel):
     blockheader: BlockHeader
 
 
+class HashrateHistoryResolution(str, Enum):
+    hour = "hour"
+    day = "day"
+
+
+class HashrateHistoryEntry(BaseModel):
+    timestamp: int = 1656450000000
+    hashrate: float = 12000132
+    difficulty: float = 1212312312
+    blueScore: int = 18483232
+
+
 @app.get(
     "/info/hashrate",
     response_model=HashrateResponse | str,
@@ -41,8 +89,7 @@ async def get_hashrate(stringOnly: bool = False):
     Returns the current hashrate for Spectre network in TH/s.
     """
 
-    resp = await spectred_client.request("getBlockDagInfoRequest")
-    hashrate = resp["getBlockDagInfoResponse"]["difficulty"] * 2
+    hashrate = (await get_blockdag_info())["difficulty"] * 2
     hashrate_in_th = hashrate / 1e12
 
     if not stringOnly:
@@ -60,47 +107,121 @@ async def get_hashrate(stringOnly: bool = False):
 @sql_db_only
 async def get_max_hashrate():
     """
-    Tracks the maximum hashrate observed incrementally by using the highest difficulty block since the
-    last recorded bluescore, effectively updating an "all-time high" whenever a new max is found.
+    Returns the maximum hashrate observed, using the highest difficulty block recorded in
+    the hashrate history.
+    """
+    async with async_session() as s:
+        entry = await s.execute(
+            select(HashrateHistory)
+            .where(HashrateHistory.resolution == "day")
+            .order_by(
+                HashrateHistory.bits.asc()
+            )  # bits and difficulty is inversely proportional
+            .limit(1)
+        )
+        entry = entry.scalar()
+
+    if entry is None:
+        raise HTTPException(
+            status_code=503, detail="Hashrate history is not available yet."
+        )
+
+    block_difficulty = bits_to_difficulty(entry.bits)
+    return {
+        "hashrate": block_difficulty * 2 / 1e12,
+        "blockheader": {
+            "hash": entry.block_hash,
+            "timestamp": entry.timestamp.isoformat(),
+            "difficulty": block_difficulty,
+            "daaScore": entry.daa_score,
+            "blueScore": entry.blue_score,
+        },
+    }
+
+
+@app.get(
+    "/info/hashrate/history",
+    response_model=List[HashrateHistoryEntry],
+    tags=["Spectre network info"],
+)
+@sql_db_only
+async def get_hashrate_history(
+    from_: int | None = Query(
+        default=None, alias="from", description="Start time in ms, inclusive"
+    ),
+    to: int | None = Query(default=None, description="End time in ms, inclusive"),
+    resolution: HashrateHistoryResolution = HashrateHistoryResolution.hour,
+):
+    """
+    Returns the maximum hashrate (TH/s) per hour or day, based on the highest difficulty block of
+    each period. Defaults to the last 1000 periods.
     """
-    maxhash_last_value = json.loads(
-        (await KeyValueStore.get("maxhash_last_value")) or "{}"
-    )
-    maxhash_last_bluescore = int(
-        (await KeyValueStore.get("maxhash_last_bluescore")) or 0
-    )
-    print(f"Start at {maxhash_last_bluescore}")
+    period = _RESOLUTION_MS[resolution]
+    to = to if to is not None else int(time.time() * 1000)
+    from_ = from_ if from_ is not None else to - 1000 * period
+
+    if (to - from_) // period > HASHRATE_HISTORY_MAX_PERIODS:
+        raise HTTPException(422, "Too many periods requested")
 
     async with async_session() as s:
-        block = (
-            await s.execute(
-                select(Block)
-                .filter(Block.blue_score > maxhash_last_bluescore)
-                .order_by(
-                    Block.bits.asc()
-                )  # bits and difficulty is inversely proportional
-                .limit(1)
-            )
-        ).scalar()
-
-    block_difficulty = bits_to_difficulty(block.bits)
-    hashrate_new = block_difficulty * 2
-    hashrate_old = maxhash_last_value.get("blockheader", {}).get("difficulty", 0) * 2
-
-    await KeyValueStore.set("maxhash_last_bluescore", str(block.blue_score))
-
-    if hashrate_new > hashrate_old:
-        response = {
-            "hashrate": hashrate_new / 1e12,
-            "blockheader": {
-                "hash": block.hash,
-                "timestamp": block.timestamp.isoformat(),
-                "difficulty": block_difficulty,
-                "daaScore": block.daa_score,
-                "blueScore": block.blue_score,
-            },
+        entries = await s.execute(
+            select(HashrateHistory)
+            .where(HashrateHistory.resolution == resolution)
+            # include the period containing from_
+            .where(HashrateHistory.bucket > from_ - period)
+            .where(HashrateHistory.bucket <= to)
+            .order_by(HashrateHistory.bucket)
+        )
+        entries = entries.scalars().all()
+
+    return [
+        {
+            "timestamp": entry.bucket,
+            "hashrate": bits_to_difficulty(entry.bits) * 2 / 1e12,
+            "difficulty": bits_to_difficulty(entry.bits),
+            "blueScore": entry.blue_score,
         }
-        await KeyValueStore.set("maxhash_last_value", json.dumps(response))
-        return response
+        for entry in entries
+    ]
 
-    return maxhash_last_value
+
+async def _add_hashrate_history(s, watermark, upper):
+    for resolution in _RESOLUTION_MS:
+        await s.execute(
+            _ADD_HASHRATE_HISTORY_QUERY,
+            {"resolution": resolution, "watermark": watermark, "upper": upper},
+        )
+
+
+@app.on_event("startup")
+@repeat_every(seconds=60)
+@statement_timeout(0)
+async def update_hashrate_history():
+    """
+    Adds the blocks above the blue score watermark to the hourly and daily hashrate
+    history. Only blue scores seen by the previous run are added, so blocks of the
+    same blue score inserted a bit later are not skipped.
+    """
+    global _previous_max_blue_score
+
+    if not IS_SQL_DB_CONFIGURED or not WorkerSnapshot.is_leader():
+        return
+
+    async with async_session_primary() as s:
+        max_blue_score = await s.execute(select(func.max(Block.blue_score)))
+        max_blue_score = max_blue_score.scalar() or 0
+
+        settled_blue_score, _previous_max_blue_score = (
+            _previous_max_blue_score,
+            max_blue_score,
+        )
+        if settled_blue_score is None:
+            return
+
+        await KeyValueStore.advance_watermark(
+            s,
+            "hashrate_history_watermark",
+            settled_blue_score,
+            HASHRATE_HISTORY_BATCH,
+            _add_hashrate_history,
+        )
@@ -1,9 +1,11 @@
 # encoding: utf-8
 
+from fastapi import HTTPException
 from pydantic import BaseModel
 
+from endpoints.get_circulating_supply import get_coin_supply
 from helper import get_spr_price
-from server import app, spectred_client
+from server import app
 
 
 class MarketCapResponse(BaseModel):
@@ -20,10 +22,11 @@ async def get_marketcap(stringOnly: bool = False):
     Get $SPR price and market cap. Price info is from coingecko.com
     """
     spr_price = await get_spr_price()
-    resp = await spectred_client.request("getCoinSupplyRequest")
-    mcap = round(
-        float(resp["getCoinSupplyResponse"]["circulatingSompi"]) / 1e8 * spr_price
-    )
+    if spr_price is None:
+        raise HTTPException(status_code=503, detail="Price not available yet.")
+
+    coin_supply = await get_coin_supply()
+    mcap = round(float(coin_supply["circulatingSompi"]) / 1e8 * spr_price)
 
     if not stringOnly:
         return {"marketcap": mcap}
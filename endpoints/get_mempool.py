@@ -0,0 +1,339 @@
+# encoding: utf-8
+import asyncio
+import bisect
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import List
+
+from fastapi import HTTPException
+from fastapi_utils.tasks import repeat_every
+from pydantic import BaseModel
+
+from helper import WorkerSnapshot
+from queries.transactions import load_outpoints
+from server import app, spectred_client
+
+IS_SQL_DB_CONFIGURED = os.getenv("SQL_URI") is not None
+# the leader polls the node's mempool and shares it with the other workers
+MEMPOOL_SNAPSHOT = os.getenv("MEMPOOL_SNAPSHOT", "true") == "true"
+MEMPOOL_POLL_INTERVAL = float(os.getenv("MEMPOOL_POLL_INTERVAL", "2"))
+# lower bounds of the fee rate histogram buckets in sompi/gram
+FEE_RATE_BUCKETS = [
+    float(b)
+    for b in os.getenv(
+        "MEMPOOL_FEE_RATE_BUCKETS", "0,1,2,5,10,20,50,100,200,500,1000,2000,5000"
+    ).split(",")
+]
+FEE_RATE_PERCENTILES = [10, 25, 50, 75, 90]
+
+_logger = logging.getLogger(__name__)
+
+# transaction id -> {"transaction": TxModel dict, "addresses": [...], "fee": int, "mass": int}
+_entries = {}
+# address -> ids of the pending transactions sending from or to it
+_by_address = defaultdict(set)
+# statistics, updated with each added and removed transaction
+_totals = {"mass": 0, "fees": 0}
+_fee_rates = []  # sorted
+_histogram = [{"count": 0, "mass": 0} for _ in FEE_RATE_BUCKETS]
+# transaction id -> line of the mempool snapshot file, each entry is encoded once
+_lines = {}
+# characters of the lines and of the changes appended to the file since it was written
+_lines_size = 0
+_appended_size = None
+
+
+# amounts and addresses of outpoints, covered by idx_txouts_outpoint_covering
+class FeeRateBucket(BaseModel):
+    feerate: float = 1.0
+    count: int = 0
+    mass: int = 0
+
+
+class FeeRatePercentiles(BaseModel):
+    p10: float | None
+    p25: float | None
+    p50: float | None
+    p75: float | None
+    p90: float | None
+
+
+class MempoolResponse(BaseModel):
+    size: int = 0
+    totalMass: int = 0
+    totalFees: int = 0
+    feeRatePercentiles: FeeRatePercentiles
+    feeRateHistogram: List[FeeRateBucket]
+
+
+@app.get(
+    "/info/mempool",
+    response_model=MempoolResponse,
+    tags=["Spectre network info"],
+)
+async def get_mempool_info():
+    """
+    Get the size, total mass and fees of the mempool and the distribution of the fee rates
+    (fee/mass in `sompi/gram`) of the pending transactions. A histogram bucket contains the
+    transactions with a fee rate from its `feerate` up to the next bucket's.
+    Served from the mempool snapshot, which is refreshed every few seconds.
+    """
+    if not MEMPOOL_SNAPSHOT:
+        raise HTTPException(status_code=503, detail="Mempool snapshot is disabled")
+
+    return {
+        "size": len(_entries),
+        "totalMass": _totals["mass"],
+        "totalFees": _totals["fees"],
+        "feeRatePercentiles": {
+            f"p{p}": _fee_rates[len(_fee_rates) * p // 100] if _fee_rates else None
+            for p in FEE_RATE_PERCENTILES
+        },
+        "feeRateHistogram": [
+            {"feerate": feerate, **bucket}
+            for feerate, bucket in zip(FEE_RATE_BUCKETS, _histogram)
+        ],
+    }
+
+
+def get_mempool_transaction(transaction_id):
+    """
+    Returns the pending transaction as TxModel dict or None.
+    """
+    entry = _entries.get(transaction_id)
+    return entry["transaction"] if entry else None
+
+
+def get_mempool_transactions_for_addresses(addresses):
+    """
+    Returns the pending transactions sending from or to any of the addresses as TxModel dicts.
+    """
+    transaction_ids = set().union(*(_by_address.get(a, ()) for a in addresses))
+    return [_entries[t]["transaction"] for t in sorted(transaction_ids)]
+
+
+def _apply_mempool(entries):
+    """
+    Updates the snapshot and the address index to entries. Only added and removed
+    transactions are touched, entries of a transaction never change.
+    """
+    for transaction_id in _entries.keys() - entries.keys():
+        entry = _entries.pop(transaction_id)
+        _update_stats(entry, -1)
+        for address in entry["addresses"]:
+            _by_address[address].discard(transaction_id)
+            if not _by_address[address]:
+                del _by_address[address]
+
+    for transaction_id in entries.keys() - _entries.keys():
+        entry = _entries[transaction_id] = entries[transaction_id]
+        _update_stats(entry, 1)
+        for address in entry["addresses"]:
+            _by_address[address].add(transaction_id)
+
+
+def _update_stats(entry, sign):
+    """
+    Adds (sign 1) or removes (sign -1) the transaction from the statistics.
+    """
+    fee_rate = entry["fee"] / entry["mass"] if entry["mass"] else 0.0
+    _totals["mass"] += sign * entry["mass"]
+    _totals["fees"] += sign * entry["fee"]
+
+    if sign > 0:
+        bisect.insort(_fee_rates, fee_rate)
+    else:
+        del _fee_rates[bisect.bisect_left(_fee_rates, fee_rate)]
+
+    bucket = _histogram[max(bisect.bisect_right(FEE_RATE_BUCKETS, fee_rate) - 1, 0)]
+    bucket["count"] += sign
+    bucket["mass"] += sign * entry["mass"]
+
+
+def _to_line(transaction_id, entry):
+    return f"+{transaction_id}\t{json.dumps(entry, separators=(',', ':'))}\n"
+
+
+async def _to_entries(mempool_entries, mempool):
+    """
+    Converts the node's mempool entries. The previous outpoints are resolved from the pending
+    transactions (chained transactions) and the database.
+    """
+    outpoints = {
+        (i["previousOutpoint"]["transactionId"], i["previousOutpoint"]["index"])
+        for e in mempool_entries
+        for i in e["transaction"]["inputs"]
+    }
+
+    resolved = {}
+    for transaction_id, index in outpoints:
+        if transaction_id in mempool:
+            outputs = mempool[transaction_id]["transaction"]["outputs"]
+            if index < len(outputs):
+                resolved[transaction_id, index] = (
+                    int(outputs[index]["amount"]),
+                    outputs[index]["verboseData"]["scriptPublicKeyAddress"],
+                )
+
+    if IS_SQL_DB_CONFIGURED and outpoints - resolved.keys():
+        resolved.update(await load_outpoints(list(outpoints - resolved.keys())))
+
+    entries = {}
+    for e in mempool_entries:
+        tx = e["transaction"]
+        transaction_id = tx["verboseData"]["transactionId"]
+        mass = max(int(tx["verboseData"]["computeMass"]), int(tx["mass"]))
+
+        inputs = []
+        for index, i in enumerate(tx["inputs"]):
+            outpoint = i["previousOutpoint"]
+            amount, address = resolved.get(
+                (outpoint["transactionId"], outpoint["index"]), (None, None)
+            )
+            inputs.append(
+                {
+                    "id": None,
+                    "transaction_id": transaction_id,
+                    "index": index,
+                    "previous_outpoint_hash": outpoint["transactionId"],
+                    "previous_outpoint_index": str(outpoint["index"]),
+                    "previous_outpoint_address": address,
+                    "previous_outpoint_amount": amount,
+                    "signature_script": i["signatureScript"],
+                    "sig_op_count": str(i["sigOpCount"]),
+                }
+            )
+
+        outputs = [
+            {
+                "id": None,
+                "transaction_id": transaction_id,
+                "index": index,
+                "amount": int(o["amount"]),
+                "script_public_key": o["scriptPublicKey"]["scriptPublicKey"],
+                "script_public_key_address": o["verboseData"]["scriptPublicKeyAddress"],
+                "script_public_key_type": o["verboseData"]["scriptPublicKeyType"],
+                "accepting_block_hash": None,
+            }
+            for index, o in enumerate(tx["outputs"])
+        ]
+
+        addresses = {o["script_public_key_address"] for o in outputs}
+        addresses.update(i["previous_outpoint_address"] for i in inputs)
+        addresses.discard(None)
+
+        entries[transaction_id] = {
+            "transaction": {
+                "subnetwork_id": tx["subnetworkId"],
+                "transaction_id": transaction_id,
+                "hash": tx["verboseData"]["hash"],
+                "mass": str(mass),
+                "block_hash": [],
+                "block_time": None,
+                "is_accepted": False,
+                "accepting_block_hash": None,
+                "accepting_block_blue_score": None,
+                "inputs": inputs,
+                "outputs": outputs,
+            },
+            "addresses": sorted(addresses),
+            "fee": int(e["fee"]),
+            "mass": mass,
+        }
+
+    return entries
+
+
+@app.on_event("startup")
+@repeat_every(seconds=MEMPOOL_POLL_INTERVAL)
+async def update_mempool():
+    """
+    Polls the node's mempool. Only transactions added since the last poll are converted.
+    The other workers load the changes from the leader's snapshot file.
+    """
+    if not MEMPOOL_SNAPSHOT:
+        return
+
+    if not WorkerSnapshot.is_leader():
+        await _load_mempool()
+        return
+
+    resp = await spectred_client.request(
+        "getMempoolEntriesRequest",
+        {"includeOrphanPool": False, "filterTransactionPool": False},
+    )
+    resp = resp["getMempoolEntriesResponse"]
+    if resp.get("error"):
+        _logger.warning(f"Mempool not available: {resp['error']}")
+        return
+
+    mempool = {
+        e["transaction"]["verboseData"]["transactionId"]: e for e in resp["entries"]
+    }
+    if mempool.keys() == _entries.keys():
+        return
+
+    entries = {t: _entries[t] for t in mempool.keys() & _entries.keys()}
+    entries.update(
+        await _to_entries([e for t, e in mempool.items() if t not in _entries], mempool)
+    )
+    _apply_mempool(entries)
+
+    if WorkerSnapshot.MULTI_WORKER:
+        await _write_mempool(entries)
+
+
+async def _write_mempool(entries):
+    """
+    Appends the added ("+" line) and removed ("-" line) transactions to the mempool
+    snapshot file. The file is written anew once the changes outgrow the mempool.
+    """
+    global _lines_size, _appended_size
+
+    changes = []
+    for transaction_id in _lines.keys() - entries.keys():
+        _lines_size -= len(_lines.pop(transaction_id))
+        changes.append(f"-{transaction_id}\n")
+    # a new leader encodes the transactions it loaded as follower
+    for transaction_id in entries.keys() - _lines.keys():
+        line = _lines[transaction_id] = _to_line(
+            transaction_id, entries[transaction_id]
+        )
+        _lines_size += len(line)
+        changes.append(line)
+
+    size = sum(len(line) for line in changes)
+    if _appended_size is None or _appended_size + size > _lines_size:
+        await WorkerSnapshot.write_lines("mempool", list(_lines.values()), append=False)
+        _appended_size = 0
+    else:
+        await WorkerSnapshot.write_lines("mempool", changes, append=True)
+        _appended_size += size
+
+
+async def _load_mempool():
+    """
+    Applies the changes of the leader's mempool snapshot file. Only added transactions are
+    decoded.
+    """
+    result = await WorkerSnapshot.read_lines("mempool")
+    if result is None:
+        return
+
+    lines, new_file = result
+    entries = {} if new_file else dict(_entries)
+    for n, line in enumerate(lines, 1):
+        transaction_id = line[1:65]
+        if line[0] == "-":
+            entries.pop(transaction_id, None)
+        elif transaction_id in _entries:
+            entries[transaction_id] = _entries[transaction_id]
+        else:
+            entries[transaction_id] = json.loads(line[66:])
+            # a whole file takes a while, the requests in between are served
+            if n % 200 == 0:
+                await asyncio.sleep(0)
+
+    _apply_mempool(entries)
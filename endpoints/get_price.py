@@ -1,9 +1,16 @@
 # encoding: utf-8
 
+from fastapi import HTTPException
+from fastapi_utils.tasks import repeat_every
 from pydantic import BaseModel
 from starlette.responses import PlainTextResponse
 
-from helper import get_spr_price, get_spr_market_data
+from helper import (
+    WorkerSnapshot,
+    get_spr_price,
+    get_spr_market_data,
+    refresh_spr_market_data,
+)
 from server import app
 
 
@@ -18,10 +25,14 @@ async def get_price(stringOnly: bool = False):
     """
     Returns the current price for Spectre in USD. Price info is from coingecko.com
     """
+    price = await get_spr_price()
+    if price is None:
+        raise HTTPException(status_code=503, detail="Price not available yet.")
+
     if stringOnly:
-        return PlainTextResponse(content=str(await get_spr_price()))
+        return PlainTextResponse(content=str(price))
 
-    return {"price": await get_spr_price()}
+    return {"price": price}
 
 
 @app.get("/info/market-data", tags=["Spectre network info"], include_in_schema=False)
@@ -29,4 +40,15 @@ async def get_market_data():
     """
     Returns market data for Spectre.
     """
-    return await get_spr_market_data()
+    market_data = await get_spr_market_data()
+    if market_data is None:
+        raise HTTPException(status_code=503, detail="Market data not available yet.")
+
+    return market_data
+
+
+@app.on_event("startup")
+@repeat_every(seconds=120)
+async def update_market_data():
+    if WorkerSnapshot.is_leader():
+        await refresh_spr_market_data()
@@ -1,11 +1,20 @@
+import math
+import os
+from typing import List
+
 from fastapi import HTTPException
 from pydantic import BaseModel
 
-from endpoints.get_transactions import search_for_transactions, TxSearch
+from endpoints.get_fee_estimate import get_cached_fee_estimate
+from endpoints.get_mempool import get_mempool_transaction
 from endpoints.spectred_requests.submit_transaction_request import SubmitTxModel
 from helper.mass_calculation_compute import calc_compute_mass
 from helper.mass_calculation_storage import calc_storage_mass
-from server import app
+from queries.transactions import load_outpoints
+from server import app, spectred_client
+
+IS_SQL_DB_CONFIGURED = os.getenv("SQL_URI") is not None
+MASS_BATCH_MAX_TRANSACTIONS = int(os.getenv("MASS_BATCH_MAX_TRANSACTIONS", "100"))
 
 
 class TxMass(BaseModel):
@@ -14,12 +23,91 @@ class TxMass(BaseModel):
     compute_mass: int
 
 
-def _get_amount_from_tx_output_index(txs, tx_id, output_index: int):
-    for tx in txs:
-        if tx["transaction_id"] == tx_id:
-            for output in tx["outputs"]:
-                if output.index == output_index:
-                    return output.amount
+class TxMassBatchRequest(BaseModel):
+    transactions: List[SubmitTxModel]
+    # the node's UTXO index is searched for outpoints of these addresses, which are not
+    # in the database or the mempool (yet)
+    utxoAddresses: List[str] = []
+
+
+class TxMassBatchResult(BaseModel):
+    mass: int | None
+    storage_mass: int | None
+    compute_mass: int | None
+    error: str | None
+
+
+class FeeQuoteBucket(BaseModel):
+    feerate: float = 1
+    estimatedSeconds: float = 0.004
+    fee: int = 2036
+
+
+class TxFeeQuote(TxMass):
+    priorityBucket: FeeQuoteBucket
+    normalBuckets: List[FeeQuoteBucket]
+    lowBuckets: List[FeeQuoteBucket]
+
+
+async def _input_amounts(txs, utxo_addresses):
+    """
+    Returns {(transaction id, index): amount} of the outpoints spent by txs, which are
+    found in the database, the mempool snapshot or the UTXOs of utxo_addresses.
+    """
+    outpoints = list(
+        {
+            (i.previousOutpoint.transactionId, i.previousOutpoint.index)
+            for tx in txs
+            for i in tx.inputs
+        }
+    )
+
+    amounts = {}
+    if IS_SQL_DB_CONFIGURED and outpoints:
+        resolved = await load_outpoints(outpoints)
+        amounts = {outpoint: amount for outpoint, (amount, _) in resolved.items()}
+
+    for transaction_id, index in outpoints:
+        pending = get_mempool_transaction(transaction_id)
+        if pending and index < len(pending["outputs"]):
+            amounts.setdefault(
+                (transaction_id, index), pending["outputs"][index]["amount"]
+            )
+
+    if utxo_addresses and amounts.keys() < set(outpoints):
+        resp = await spectred_client.request(
+            "getUtxosByAddressesRequest",
+            params={"addresses": utxo_addresses},
+            timeout=120,
+        )
+        for utxo in resp["getUtxosByAddressesResponse"].get("entries", []):
+            outpoint = (utxo["outpoint"]["transactionId"], utxo["outpoint"]["index"])
+            amounts.setdefault(outpoint, int(utxo["utxoEntry"]["amount"]))
+
+    return amounts
+
+
+def _calc_mass(tx, amounts):
+    """
+    Returns the TxMass of tx or None, if an input amount is unknown.
+    """
+    tx_input_amounts = [
+        amounts.get((i.previousOutpoint.transactionId, i.previousOutpoint.index))
+        for i in tx.inputs
+    ]
+    if None in tx_input_amounts:
+        return None
+
+    tx_output_amounts = [output.amount for output in tx.outputs]
+
+    storage_mass = calc_storage_mass(tx_input_amounts, tx_output_amounts)
+    compute_mass = calc_compute_mass(tx.dict())
+
+    return TxMass(
+        mass=max(storage_mass, compute_mass),
+        storage_mass=storage_mass,
+        compute_mass=compute_mass,
+    )
 
 
 @app.post(
@@ -35,39 +123,87 @@ async def calculate_transaction_mass(tx: SubmitTxModel):
 
     Note: Be aware that if the transaction has a very low output amount or a high number of outputs, the mass can become significantly large.
     """
-    previous_outpoints = [input.previousOutpoint for input in tx.inputs]
-
-    txs = list(
-        await search_for_transactions(
-            TxSearch(
-                transactionIds=list([x.transactionId for x in previous_outpoints])
-            ),
-            "",
-            False,
-        )
-    )
+    try:
+        tx_mass = _calc_mass(tx, await _input_amounts([tx], []))
+    except ZeroDivisionError:
+        # storage mass of zero amounts or of no inputs
+        raise HTTPException(status_code=422, detail="Zero amount or no inputs.")
 
-    if len(txs) != len(set([x.transactionId for x in previous_outpoints])):
+    if tx_mass is None:
         raise HTTPException(
             status_code=404, detail="Previous outpoint(s) not found in database."
         )
 
-    tx_input_amounts = [
-        _get_amount_from_tx_output_index(
-            txs,
-            previous_outpoint.transactionId,
-            previous_outpoint.index,
+    return tx_mass
+
+
+@app.post(
+    "/transactions/mass/batch",
+    response_model=List[TxMassBatchResult],
+    tags=["Spectre transactions"],
+    response_model_exclude_unset=True,
+)
+async def calculate_transaction_mass_batch(body: TxMassBatchRequest):
+    """
+    Calculates the mass of up to 100 (unsigned) transactions, e.g. the candidates of a
+    coin selection, in one request. The results are in the order of the transactions.
+
+    The input amounts are looked up in the database and the mempool. Outpoints not found
+    there are looked up in the UTXOs of `utxoAddresses`, if given. A transaction with an
+    unknown input gets an `error` instead of a mass.
+    """
+    if len(body.transactions) > MASS_BATCH_MAX_TRANSACTIONS:
+        raise HTTPException(422, "Too many transactions")
+
+    amounts = await _input_amounts(body.transactions, body.utxoAddresses)
+
+    results = []
+    for tx in body.transactions:
+        try:
+            tx_mass = _calc_mass(tx, amounts)
+        except ZeroDivisionError:
+            # storage mass of zero amounts or of no inputs
+            results.append({"error": "Zero amount or no inputs."})
+            continue
+
+        if tx_mass is None:
+            results.append({"error": "Previous outpoint(s) not found."})
+        else:
+            results.append(tx_mass.dict())
+
+    return results
+
+
+@app.post(
+    "/transactions/fee-quote",
+    response_model=TxFeeQuote,
+    tags=["Spectre transactions"],
+)
+async def quote_transaction_fee(tx: SubmitTxModel):
+    """
+    Calculates the mass of a transaction like `/transactions/mass` and the required fee
+    (`fee = feerate * mass`, rounded up) for each bucket of `/info/fee-estimate`. The fee
+    estimate is polled in the background, it is not requested from Spectred per call.
+    """
+    try:
+        tx_mass = _calc_mass(tx, await _input_amounts([tx], []))
+    except ZeroDivisionError:
+        # storage mass of zero amounts or of no inputs
+        raise HTTPException(status_code=422, detail="Zero amount or no inputs.")
+
+    if tx_mass is None:
+        raise HTTPException(
+            status_code=404, detail="Previous outpoint(s) not found in database."
         )
-        for previous_outpoint in previous_outpoints
-    ]
 
-    tx_output_amounts = [output.amount for output in tx.outputs]
+    estimate = await get_cached_fee_estimate()
 
-    storage_mass = calc_storage_mass(tx_input_amounts, tx_output_amounts)
-    compute_mass = calc_compute_mass(tx.dict())
+    def quote(bucket):
+        return {**bucket, "fee": math.ceil(bucket["feerate"] * tx_mass.mass)}
 
-    return TxMass(
-        mass=max(storage_mass, compute_mass),
-        storage_mass=storage_mass,
-        compute_mass=compute_mass,
-    )
+    return {
+        **tx_mass.dict(),
+        "priorityBucket": quote(estimate["priorityBucket"]),
+        "normalBuckets": [quote(b) for b in estimate["normalBuckets"]],
+        "lowBuckets": [quote(b) for b in estimate["lowBuckets"]],
+    }
@@ -1,16 +1,27 @@
 # encoding: utf-8
-
+import os
+from collections import defaultdict
 from enum import Enum
 from typing import List
 
+from cachetools import LRUCache
 from fastapi import Path, HTTPException, Query, Response
 from pydantic import BaseModel, parse_obj_as
-from sqlalchemy.future import select
-
-from dbsession import async_session
-from endpoints import filter_fields, sql_db_only
-from models.Block import Block
-from models.Transaction import Transaction, TransactionOutput, TransactionInput
+from sqlalchemy import text
+from starlette.responses import StreamingResponse
+
+from dbsession import async_session, gather_reads
+from endpoints import filter_fields, sql_db_only, statement_timeout
+from endpoints.get_mempool import get_mempool_transaction
+from endpoints.get_virtual_chain_blue_score import current_blue_score_data
+from queries.transactions import (
+    ACCEPTANCE_QUERY,
+    INPUTS_QUERY,
+    INPUTS_RESOLVED_LIGHT_QUERY,
+    INPUTS_RESOLVED_QUERY,
+    OUTPUTS_QUERY,
+    transactions_query,
+)
 from server import app
 
 DESC_RESOLVE_PARAM = (
@@ -18,10 +29,27 @@ DESC_RESOLVE_PARAM = (
     " 'Light' mode fetches only the address and amount, while 'Full' mode fetches the entire TransactionOutput"
     " and adds it to each TxInput."
 )
+DESC_MEMPOOL_PARAM = "Include pending transactions from the mempool."
+
+# "orm" assembles the transactions in python, "json" builds the JSON in postgres
+USE_JSON_QUERY_ENGINE = os.getenv("TX_QUERY_ENGINE", "orm") == "json"
+TRANSACTION_STATEMENT_TIMEOUT = int(
+    os.getenv("SQL_STATEMENT_TIMEOUT_TRANSACTIONS", "15000")
+)
+ACCEPTANCE_MAX_TRANSACTIONS = int(os.getenv("ACCEPTANCE_MAX_TRANSACTIONS", "5000"))
+# the acceptance of a transaction with this many confirmations can't change anymore
+ACCEPTANCE_FINAL_CONFIRMATIONS = int(
+    os.getenv("ACCEPTANCE_FINAL_CONFIRMATIONS", "86400")
+)
+ACCEPTANCE_CACHE_SIZE = int(os.getenv("ACCEPTANCE_CACHE_SIZE", "100000"))
+
+# transaction id -> (is_accepted, accepting block hash, accepting block blue score)
+_final_acceptance = LRUCache(maxsize=ACCEPTANCE_CACHE_SIZE)
 
 
 class TxOutput(BaseModel):
-    id: int
+    # None for pending transactions from the mempool
+    id: int | None
     transaction_id: str
     index: int
     amount: int
@@ -35,7 +63,7 @@ class TxOutput(BaseModel):
 
 
 class TxInput(BaseModel):
-    id: int
+    id: int | None
     transaction_id: str
     index: int
     previous_outpoint_hash: str
@@ -71,6 +99,14 @@ class TxSearch(BaseModel):
     transactionIds: List[str]
 
 
+class TxAcceptance(BaseModel):
+    transaction_id: str
+    is_accepted: bool | None
+    accepting_block_hash: str | None
+    accepting_block_blue_score: int | None
+    confirmations: int | None
+
+
 class PreviousOutpointLookupMode(str, Enum):
     no = "no"
     light = "light"
@@ -84,106 +120,66 @@ class PreviousOutpointLookupMode(str, Enum):
     response_model_exclude_unset=True,
 )
 @sql_db_only
+@statement_timeout(TRANSACTION_STATEMENT_TIMEOUT)
 async def get_transaction(
     response: Response,
     transactionId: str = Path(regex="[a-f0-9]{64}"),
     inputs: bool = True,
     outputs: bool = True,
+    fields: str = "",
     resolve_previous_outpoints: PreviousOutpointLookupMode = Query(
         default=PreviousOutpointLookupMode.no, description=DESC_RESOLVE_PARAM
     ),
+    include_mempool: bool = Query(default=False, description=DESC_MEMPOOL_PARAM),
 ):
     """
     Retrieves transaction details for a given transaction ID from the database.
-    Optionally includes `inputs` and `outputs`. Use `resolve_previous_outpoints` to
+    Optionally includes `inputs` and `outputs`. Use `fields` to load only the listed
+    fields, e.g. `transaction_id,block_time,is_accepted`. Use `resolve_previous_outpoints` to
     enrich each input with data from the referenced previous outpoint. Modes:
     - `no`: No outpoint resolution.
     - `light`: Includes only address and amount.
     - `full`: Full outpoint data.
-    """
-    async with async_session() as s:
-        tx = await s.execute(
-            select(Transaction, Block.blue_score)
-            .join(Block, Transaction.accepting_block_hash == Block.hash, isouter=True)
-            .filter(Transaction.transaction_id == transactionId)
-        )
-
-        tx = tx.first()
-
-        tx_outputs = None
-        tx_inputs = None
-
-        if outputs:
-            tx_outputs = await s.execute(
-                select(TransactionOutput).filter(
-                    TransactionOutput.transaction_id == transactionId
-                )
-            )
 
-            tx_outputs = tx_outputs.scalars().all()
-
-        if inputs:
-            if resolve_previous_outpoints in ["light", "full"]:
-                tx_inputs = await s.execute(
-                    select(TransactionInput, TransactionOutput)
-                    .outerjoin(
-                        TransactionOutput,
-                        (
-                            TransactionOutput.transaction_id
-                            == TransactionInput.previous_outpoint_hash
-                        )
-                        & (
-                            TransactionOutput.index
-                            == TransactionInput.previous_outpoint_index
-                        ),
-                    )
-                    .filter(TransactionInput.transaction_id == transactionId)
-                )
+    With `include_mempool`, a pending transaction, which is not in the database yet, is
+    returned from the mempool without `block_hash` and with address and amount of the inputs.
+    """
+    fields = fields.split(",") if fields else []
 
-                tx_inputs = tx_inputs.all()
-
-                if resolve_previous_outpoints in ["light", "full"]:
-                    for tx_in, tx_prev_outputs in tx_inputs:
-                        # it is possible, that the old tx is not in database. Leave fields empty
-                        if not tx_prev_outputs:
-                            tx_in.previous_outpoint_amount = None
-                            tx_in.previous_outpoint_address = None
-                            if resolve_previous_outpoints == "full":
-                                tx_in.previous_outpoint_resolved = None
-                            continue
-
-                        tx_in.previous_outpoint_amount = tx_prev_outputs.amount
-                        tx_in.previous_outpoint_address = (
-                            tx_prev_outputs.script_public_key_address
-                        )
-                        if resolve_previous_outpoints == "full":
-                            tx_in.previous_outpoint_resolved = tx_prev_outputs
-
-                # remove unneeded list
-                tx_inputs = [x[0] for x in tx_inputs]
-
-            else:
-                tx_inputs = await s.execute(
-                    select(TransactionInput).filter(
-                        TransactionInput.transaction_id == transactionId
-                    )
-                )
-                tx_inputs = tx_inputs.scalars().all()
+    tx, tx_inputs, tx_outputs = await gather_reads(
+        lambda s: _load_transactions(s, [transactionId], fields),
+        (lambda s: _load_inputs(s, [transactionId], resolve_previous_outpoints))
+        if inputs and (not fields or "inputs" in fields)
+        else None,
+        (lambda s: _load_outputs(s, [transactionId]))
+        if outputs and (not fields or "outputs" in fields)
+        else None,
+    )
+    tx = tx[0] if tx else None
 
     if tx:
-        return {
-            "subnetwork_id": tx.Transaction.subnetwork_id,
-            "transaction_id": tx.Transaction.transaction_id,
-            "hash": tx.Transaction.hash,
-            "mass": tx.Transaction.mass,
-            "block_hash": tx.Transaction.block_hash,
-            "block_time": tx.Transaction.block_time,
-            "is_accepted": tx.Transaction.is_accepted,
-            "accepting_block_hash": tx.Transaction.accepting_block_hash,
-            "accepting_block_blue_score": tx.blue_score,
-            "outputs": parse_obj_as(List[TxOutput], tx_outputs) if tx_outputs else None,
-            "inputs": parse_obj_as(List[TxInput], tx_inputs) if tx_inputs else None,
-        }
+        return filter_fields(
+            {
+                **tx._mapping,
+                "outputs": parse_obj_as(List[TxOutput], tx_outputs)
+                if tx_outputs
+                else None,
+                "inputs": parse_obj_as(List[TxInput], tx_inputs) if tx_inputs else None,
+            },
+            fields,
+        )
+
+    pending = get_mempool_transaction(transactionId) if include_mempool else None
+    if pending:
+        response.headers["Cache-Control"] = "public, max-age=3"
+        return filter_fields(
+            {
+                **pending,
+                "inputs": pending["inputs"] if inputs else None,
+                "outputs": pending["outputs"] if outputs else None,
+            },
+            fields,
+        )
     else:
         raise HTTPException(
             status_code=404,
@@ -199,6 +195,7 @@ async def get_transaction(
     response_model_exclude_unset=True,
 )
 @sql_db_only
+@statement_timeout(TRANSACTION_STATEMENT_TIMEOUT)
 async def search_for_transactions(
     txSearch: TxSearch,
     fields: str = "",
@@ -229,108 +226,126 @@ async def search_for_transactions(
 
     fields = fields.split(",") if fields else []
 
-    async with async_session() as s:
-        tx_list = await s.execute(
-            select(Transaction, Block.blue_score)
-            .join(Block, Transaction.accepting_block_hash == Block.hash, isouter=True)
-            .filter(Transaction.transaction_id.in_(txSearch.transactionIds))
-            .order_by(Transaction.block_time.desc())
+    if USE_JSON_QUERY_ENGINE:
+        body = stream_transactions_json(
+            txSearch.transactionIds, fields, resolve_previous_outpoints
+        )
+        # the statement runs and the first rows are fetched before the response starts,
+        # so the statement timeout applies and errors still result in a status code
+        first_chunk = await anext(body)
+        return StreamingResponse(
+            _prepend_chunk(first_chunk, body), media_type="application/json"
         )
 
-        tx_list = tx_list.all()
-
-        if not fields or "inputs" in fields:
-            # join TxOutputs if needed
-            if resolve_previous_outpoints in ["light", "full"]:
-                tx_inputs = await s.execute(
-                    select(TransactionInput, TransactionOutput)
-                    .outerjoin(
-                        TransactionOutput,
-                        (
-                            TransactionOutput.transaction_id
-                            == TransactionInput.previous_outpoint_hash
-                        )
-                        & (
-                            TransactionOutput.index
-                            == TransactionInput.previous_outpoint_index
-                        ),
-                    )
-                    .filter(
-                        TransactionInput.transaction_id.in_(txSearch.transactionIds)
-                    )
-                )
+    return await query_transactions(
+        txSearch.transactionIds, fields, resolve_previous_outpoints
+    )
 
-            # without joining previous_tx_outputs
-            else:
-                tx_inputs = await s.execute(
-                    select(TransactionInput).filter(
-                        TransactionInput.transaction_id.in_(txSearch.transactionIds)
-                    )
-                )
-            tx_inputs = tx_inputs.all()
-
-            if resolve_previous_outpoints in ["light", "full"]:
-                for tx_in, tx_prev_outputs in tx_inputs:
-                    # it is possible, that the old tx is not in database. Leave fields empty
-                    if not tx_prev_outputs:
-                        tx_in.previous_outpoint_amount = None
-                        tx_in.previous_outpoint_address = None
-                        if resolve_previous_outpoints == "full":
-                            tx_in.previous_outpoint_resolved = None
-                        continue
-
-                    tx_in.previous_outpoint_amount = tx_prev_outputs.amount
-                    tx_in.previous_outpoint_address = (
-                        tx_prev_outputs.script_public_key_address
-                    )
-                    if resolve_previous_outpoints == "full":
-                        tx_in.previous_outpoint_resolved = tx_prev_outputs
-
-            # remove unneeded list
-            tx_inputs = [x[0] for x in tx_inputs]
 
+@app.post(
+    "/transactions/acceptance",
+    response_model=List[TxAcceptance],
+    tags=["Spectre transactions"],
+)
+@sql_db_only
+@statement_timeout(TRANSACTION_STATEMENT_TIMEOUT)
+async def get_transactions_acceptance(txSearch: TxSearch):
+    """
+    Returns the acceptance status of up to 5000 transactions: `is_accepted`, the accepting
+    block and the confirmations, which are the blue scores between the accepting block and
+    the virtual selected parent. Unknown transaction ids are omitted.
+    """
+    if len(txSearch.transactionIds) > ACCEPTANCE_MAX_TRANSACTIONS:
+        raise HTTPException(422, "Too many transaction ids")
+
+    transaction_ids = list(dict.fromkeys(txSearch.transactionIds))
+    blue_score = current_blue_score_data["blue_score"]
+
+    acceptance = {}
+    uncached_ids = []
+    for transaction_id in transaction_ids:
+        cached = _final_acceptance.get(transaction_id)
+        if cached:
+            acceptance[transaction_id] = cached
         else:
-            tx_inputs = None
+            uncached_ids.append(transaction_id)
 
-        if not fields or "outputs" in fields:
-            tx_outputs = await s.execute(
-                select(TransactionOutput).filter(
-                    TransactionOutput.transaction_id.in_(txSearch.transactionIds)
-                )
+    if uncached_ids:
+        async with async_session() as s:
+            rows = await s.execute(ACCEPTANCE_QUERY, {"transaction_ids": uncached_ids})
+
+        for row in rows:
+            acceptance[row.transaction_id] = (
+                row.is_accepted,
+                row.accepting_block_hash,
+                row.accepting_block_blue_score,
             )
-            tx_outputs = tx_outputs.scalars().all()
-        else:
-            tx_outputs = None
+            confirmations = _confirmations(
+                row.is_accepted, row.accepting_block_blue_score, blue_score
+            )
+            if confirmations and confirmations >= ACCEPTANCE_FINAL_CONFIRMATIONS:
+                _final_acceptance[row.transaction_id] = acceptance[row.transaction_id]
+
+    return [
+        {
+            "transaction_id": transaction_id,
+            "is_accepted": is_accepted,
+            "accepting_block_hash": accepting_block_hash,
+            "accepting_block_blue_score": accepting_blue_score,
+            "confirmations": _confirmations(
+                is_accepted, accepting_blue_score, blue_score
+            ),
+        }
+        for transaction_id in transaction_ids
+        if transaction_id in acceptance
+        for is_accepted, accepting_block_hash, accepting_blue_score in (
+            acceptance[transaction_id],
+        )
+    ]
+
+
+def _confirmations(is_accepted, accepting_blue_score, blue_score):
+    if not is_accepted:
+        return 0
+    if accepting_blue_score is None or not blue_score:
+        # accepting block not in database or virtual blue score not known yet
+        return None
+    return max(blue_score - accepting_blue_score, 0)
+
+
+async def query_transactions(
+    transaction_ids: List[str],
+    fields: List[str],
+    resolve_previous_outpoints: PreviousOutpointLookupMode,
+):
+    """
+    Loads transactions, inputs and outputs concurrently as ORM objects and assembles the
+    TxModel dicts.
+    """
+    tx_list, tx_inputs, tx_outputs = await gather_reads(
+        lambda s: _load_transactions(s, transaction_ids, fields),
+        (lambda s: _load_inputs(s, transaction_ids, resolve_previous_outpoints))
+        if not fields or "inputs" in fields
+        else None,
+        (lambda s: _load_outputs(s, transaction_ids))
+        if not fields or "outputs" in fields
+        else None,
+    )
+
+    tx_inputs_by_id = _group_by_transaction_id(tx_inputs)
+    tx_outputs_by_id = _group_by_transaction_id(tx_outputs)
 
     return (
         filter_fields(
             {
-                "subnetwork_id": tx.Transaction.subnetwork_id,
-                "transaction_id": tx.Transaction.transaction_id,
-                "hash": tx.Transaction.hash,
-                "mass": tx.Transaction.mass,
-                "block_hash": tx.Transaction.block_hash,
-                "block_time": tx.Transaction.block_time,
-                "is_accepted": tx.Transaction.is_accepted,
-                "accepting_block_hash": tx.Transaction.accepting_block_hash,
-                "accepting_block_blue_score": tx.blue_score,
+                **tx._mapping,
                 "outputs": parse_obj_as(
-                    List[TxOutput],
-                    [
-                        x
-                        for x in tx_outputs
-                        if x.transaction_id == tx.Transaction.transaction_id
-                    ],
+                    List[TxOutput], tx_outputs_by_id.get(tx.transaction_id, [])
                 )
                 if tx_outputs
                 else None,  # parse only if needed
                 "inputs": parse_obj_as(
-                    List[TxInput],
-                    [
-                        x
-                        for x in tx_inputs
-                        if x.transaction_id == tx.Transaction.transaction_id
-                    ],
+                    List[TxInput], tx_inputs_by_id.get(tx.transaction_id, [])
                 )
                 if tx_inputs
                 else None,  # parse only if needed
@@ -339,3 +354,171 @@ async def search_for_transactions(
         )
         for tx in tx_list
     )
+
+
+async def _load_transactions(s, transaction_ids, fields):
+    tx_list = await s.execute(
+        transactions_query(frozenset(f for f in fields if f in TxModel.__fields__)),
+        {"transaction_ids": transaction_ids},
+    )
+    return tx_list.all()
+
+
+async def _load_inputs(s, transaction_ids, resolve_previous_outpoints):
+    if resolve_previous_outpoints == "light":
+        tx_inputs = await s.execute(
+            INPUTS_RESOLVED_LIGHT_QUERY, {"transaction_ids": transaction_ids}
+        )
+        tx_inputs = tx_inputs.all()
+
+        # amount and address are None, if the old tx is not in database
+        for tx_in, amount, address in tx_inputs:
+            tx_in.previous_outpoint_amount = amount
+            tx_in.previous_outpoint_address = address
+
+        return [x[0] for x in tx_inputs]
+
+    # join TxOutputs if needed
+    if resolve_previous_outpoints == "full":
+        tx_inputs = await s.execute(
+            INPUTS_RESOLVED_QUERY, {"transaction_ids": transaction_ids}
+        )
+
+    # without joining previous_tx_outputs
+    else:
+        tx_inputs = await s.execute(INPUTS_QUERY, {"transaction_ids": transaction_ids})
+    tx_inputs = tx_inputs.all()
+
+    if resolve_previous_outpoints == "full":
+        for tx_in, tx_prev_outputs in tx_inputs:
+            # it is possible, that the old tx is not in database. Leave fields empty
+            if not tx_prev_outputs:
+                tx_in.previous_outpoint_amount = None
+                tx_in.previous_outpoint_address = None
+                tx_in.previous_outpoint_resolved = None
+                continue
+
+            tx_in.previous_outpoint_amount = tx_prev_outputs.amount
+            tx_in.previous_outpoint_address = tx_prev_outputs.script_public_key_address
+            tx_in.previous_outpoint_resolved = tx_prev_outputs
+
+    # remove unneeded list
+    return [x[0] for x in tx_inputs]
+
+
+async def _load_outputs(s, transaction_ids):
+    tx_outputs = await s.execute(OUTPUTS_QUERY, {"transaction_ids": transaction_ids})
+    return tx_outputs.scalars().all()
+
+
+def _group_by_transaction_id(rows):
+    grouped = defaultdict(list)
+    for row in rows or []:
+        grouped[row.transaction_id].append(row)
+    return grouped
+
+
+def _output_json(alias):
+    return (
+        f"json_build_object('id', {alias}.id, 'transaction_id', {alias}.transaction_id, "
+        f"'index', {alias}.index, 'amount', {alias}.amount, "
+        f"'script_public_key', {alias}.script_public_key, "
+        f"'script_public_key_address', {alias}.script_public_key_address, "
+        f"'script_public_key_type', {alias}.script_public_key_type, "
+        f"'accepting_block_hash', {alias}.accepting_block_hash)"
+    )
+
+
+def _input_json(resolve_previous_outpoints):
+    # the response model always contains the previous outpoint fields, null if not resolved
+    resolved, address, amount = "NULL", "NULL", "NULL"
+    if resolve_previous_outpoints == "full":
+        resolved = f"CASE WHEN po.id IS NULL THEN NULL ELSE {_output_json('po')} END"
+    if resolve_previous_outpoints in ["light", "full"]:
+        address, amount = "po.script_public_key_address", "po.amount"
+    return (
+        "json_build_object('id', ti.id, 'transaction_id', ti.transaction_id, "
+        "'index', ti.index, 'previous_outpoint_hash', ti.previous_outpoint_hash, "
+        "'previous_outpoint_index', ti.previous_outpoint_index::text, "
+        f"'previous_outpoint_resolved', {resolved}, "
+        f"'previous_outpoint_address', {address}, "
+        f"'previous_outpoint_amount', {amount}, "
+        "'signature_script', ti.signature_script, 'sig_op_count', ti.sig_op_count::text)"
+    )
+
+
+def _transactions_json_query(fields, resolve_previous_outpoints):
+    """
+    Builds one statement returning a TxModel JSON document per transaction. Inputs and outputs
+    are aggregated by lateral subqueries, which are only joined if the fields are requested.
+    """
+    tx_fields = [f for f in TxModel.__fields__ if not fields or f in fields]
+
+    # like the ORM path, inputs/outputs are null if none of the transactions has any
+    columns = {
+        "accepting_block_blue_score": "b.blue_score",
+        "inputs": "CASE WHEN bool_or(i.inputs IS NOT NULL) OVER () "
+        "THEN coalesce(i.inputs, '[]') END",
+        "outputs": "CASE WHEN bool_or(o.outputs IS NOT NULL) OVER () "
+        "THEN coalesce(o.outputs, '[]') END",
+    }
+
+    joins = ""
+    if "accepting_block_blue_score" in tx_fields:
+        joins += " LEFT JOIN blocks b ON b.hash = t.accepting_block_hash"
+    if "inputs" in tx_fields:
+        prev_outputs_join = ""
+        if resolve_previous_outpoints in ["light", "full"]:
+            prev_outputs_join = (
+                " LEFT JOIN transactions_outputs po"
+                " ON po.transaction_id = ti.previous_outpoint_hash"
+                " AND po.index = ti.previous_outpoint_index"
+            )
+        input_json = _input_json(resolve_previous_outpoints)
+        joins += (
+            " LEFT JOIN LATERAL ("
+            f"SELECT json_agg({input_json} ORDER BY ti.index) AS inputs"
+            f" FROM transactions_inputs ti{prev_outputs_join}"
+            " WHERE ti.transaction_id = t.transaction_id) i ON true"
+        )
+    if "outputs" in tx_fields:
+        joins += (
+            " LEFT JOIN LATERAL ("
+            f"SELECT json_agg({_output_json('tout')} ORDER BY tout.index) AS outputs"
+            " FROM transactions_outputs tout"
+            " WHERE tout.transaction_id = t.transaction_id) o ON true"
+        )
+
+    tx_json = ", ".join(f"'{f}', {columns.get(f, 't.' + f)}" for f in tx_fields)
+    return (
+        f"SELECT json_build_object({tx_json})::text FROM transactions t{joins}"
+        " WHERE t.transaction_id = ANY(:ids)"
+        " ORDER BY t.block_time DESC, t.transaction_id"
+    )
+
+
+async def stream_transactions_json(
+    transaction_ids: List[str],
+    fields: List[str],
+    resolve_previous_outpoints: PreviousOutpointLookupMode,
+):
+    """
+    Yields the transactions as JSON array, built in a single SQL statement. Neither ORM objects
+    nor pydantic models are created. The first chunk is "[" with the first transactions or "[]".
+    """
+    async with async_session() as s:
+        result = await s.stream(
+            text(_transactions_json_query(fields, resolve_previous_outpoints)),
+            {"ids": transaction_ids},
+        )
+        separator = "["
+        async for rows in result.partitions(100):
+            yield separator + ",".join(row[0] for row in rows)
+            separator = ","
+        yield "]" if separator == "," else "[]"
+
+
+async def _prepend_chunk(chunk, body):
+    yield chunk
+    async for chunk in body:
+        yield chunk
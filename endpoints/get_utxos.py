@@ -4,8 +4,11 @@ import os
 from typing import List
 
 from fastapi import Path, HTTPException
+from fastapi import Response
 from pydantic import BaseModel
+from starlette.requests import Request
 
+from endpoints import PROTOBUF_MEDIA_TYPE, PROTOBUF_RESPONSE, accepts_protobuf
 from server import app, spectred_client
 
 SPECTRE_ADDRESS_PREFIX = os.getenv("ADDRESS_PREFIX", "spectre")
@@ -44,8 +47,11 @@ class UtxoResponse(BaseModel):
     "/addresses/{spectreAddress}/utxos",
     response_model=List[UtxoResponse],
     tags=["Spectre addresses"],
+    responses=PROTOBUF_RESPONSE,
 )
 async def get_utxos_for_address(
+    request: Request,
+    response: Response,
     spectreAddress: str = Path(
         description="Spectre address as string e.g. "
         + SPECTRE_ADDRESS_PREFIX
@@ -55,7 +61,28 @@ async def get_utxos_for_address(
 ):
     """
     List all unspent transaction outputs (UTXOs) for the specified Spectre address.
+
+    Send `Accept: application/x-protobuf` to receive the serialized `GetUtxosByAddressesResponseMessage`
+    from Spectred instead of JSON.
     """
+    response.headers["Vary"] = "Accept"
+
+    if accepts_protobuf(request):
+        resp = await spectred_client.request(
+            "getUtxosByAddressesRequest",
+            params={"addresses": [spectreAddress]},
+            timeout=120,
+            raw=True,
+        )
+        utxos_resp = resp.getUtxosByAddressesResponse
+        if utxos_resp.HasField("error"):
+            raise HTTPException(status_code=400, detail=utxos_resp.error.message)
+        return Response(
+            content=utxos_resp.SerializeToString(),
+            media_type=PROTOBUF_MEDIA_TYPE,
+            headers={"Vary": "Accept"},
+        )
+
     resp = await spectred_client.request(
         "getUtxosByAddressesRequest",
         params={"addresses": [spectreAddress]},
@@ -2,11 +2,19 @@
 from fastapi_utils.tasks import repeat_every
 from pydantic import BaseModel
 
+from helper import WorkerSnapshot
 from server import app, spectred_client
 
 current_blue_score_data = {"blue_score": 0}
 
 
+def _set_blue_score(blue_score):
+    current_blue_score_data["blue_score"] = blue_score
+
+
+WorkerSnapshot.subscribe("blue_score", _set_blue_score)
+
+
 class BlockdagResponse(BaseModel):
     blueScore: int = 260890
 
@@ -28,7 +36,10 @@ async def get_virtual_selected_parent_blue_score():
 @repeat_every(seconds=5)
 async def update_blue_score():
     global current_blue_score_data
+    if not WorkerSnapshot.is_leader():
+        return
     resp = await spectred_client.request("getSinkBlueScoreRequest")
     current_blue_score_data["blue_score"] = int(
         resp["getSinkBlueScoreResponse"]["blueScore"]
     )
+    WorkerSnapshot.publish("blue_score", current_blue_score_data["blue_score"])
@@ -1,13 +1,37 @@
 # encoding: utf-8
-
+import asyncio
+import logging
+import os
 from typing import List
 
+from cachetools import TTLCache
 from fastapi import Query
 from pydantic import BaseModel
 from starlette.responses import JSONResponse
 
+from helper.mass_calculation_compute import (
+    MAXIMUM_STANDARD_TRANSACTION_MASS,
+    calc_compute_mass,
+)
+from helper.transaction_serialization import (
+    MAX_TRANSACTION_VERSION,
+    serialize_transaction,
+    transaction_hash,
+    transaction_id,
+)
 from server import app, spectred_client
 
+# accepted submissions are remembered for SUBMIT_DEDUPE_TTL seconds
+SUBMIT_DEDUPE_TTL = int(os.getenv("SUBMIT_DEDUPE_TTL", "600"))
+SUBMIT_DEDUPE_CACHE_SIZE = int(os.getenv("SUBMIT_DEDUPE_CACHE_SIZE", "10000"))
+
+_logger = logging.getLogger(__name__)
+
+# transaction hash -> transaction id of the accepted submissions
+_submitted = TTLCache(maxsize=SUBMIT_DEDUPE_CACHE_SIZE, ttl=SUBMIT_DEDUPE_TTL)
+# (transaction hash, replace by fee, allow orphan) -> task of the running submission
+_submitting = {}
+
 
 class SubmitTxOutpoint(BaseModel):
     transactionId: str
@@ -91,8 +115,40 @@ async def submit_a_new_transaction(
 
     Note:
     This endpoint forwards the request to the Spectre client, which processes the transaction with the specified parameters and handles replacements if `replaceByFee` is enabled.
+    Transactions, which can't be serialized or exceed the maximum standard compute mass, are rejected without contacting the node.
+    Resubmitting an accepted transaction returns its ID without contacting the node again. Identical submissions, which arrive while
+    the first one is being processed, share its result.
+    """
+    tx = body.transaction.dict()
+    error = _check_transaction(tx)
+    if error:
+        return JSONResponse(status_code=400, content={"error": error})
+
+    # retries of an accepted transaction are answered without the node. The hash covers
+    # the signature scripts, so a re-signed transaction with the same id is submitted.
+    tx_hash = transaction_hash(tx)
+    if tx_hash in _submitted:
+        return {"transactionId": _submitted[tx_hash]}
+
+    key = (tx_hash, replaceByFee, body.allowOrphan)
+    if key not in _submitting:
+        task = asyncio.ensure_future(_submit(body, tx, tx_hash, replaceByFee))
+        _submitting[key] = task
+        task.add_done_callback(lambda _: _submitting.pop(key, None))
+
+    # concurrent identical submissions wait for the same node request. A disconnecting
+    # client doesn't cancel it for the others.
+    status_code, content = await asyncio.shield(_submitting[key])
+    if status_code != 200:
+        return JSONResponse(status_code=status_code, content=content)
+    return content
+
+
+async def _submit(body, tx, tx_hash, replace_by_fee):
+    """
+    Submits the transaction to the node. Returns status code and content of the response.
     """
-    if replaceByFee:
+    if replace_by_fee:
         # Replace by fee doesn't have the allowOrphan attribute
         body = SubmitTransactionReplacementRequest(transaction=body.transaction)
         tx_resp = await spectred_client.request(
@@ -105,20 +161,41 @@ async def submit_a_new_transaction(
         )
         tx_resp = tx_resp["submitTransactionResponse"]
 
-    tx_resp = tx_resp["submitTransactionResponse"]
-
     if "error" in tx_resp:
-        return JSONResponse(
-            status_code=400, content={"error": tx_resp["error"].get("message", "")}
-        )
+        return 400, {"error": tx_resp["error"].get("message", "")}
 
     # if transactionId is in response
     elif "transactionId" in tx_resp:
-        return {"transactionId": tx_resp["transactionId"]}
+        if tx_resp["transactionId"] != transaction_id(tx):
+            _logger.warning(
+                f"Local transaction id {transaction_id(tx)} differs from {tx_resp['transactionId']}"
+            )
+        _submitted[tx_hash] = tx_resp["transactionId"]
+        return 200, {"transactionId": tx_resp["transactionId"]}
 
     # something else went wrong
     else:
-        return JSONResponse(status_code=400, content={"error": str(tx_resp)})
+        return 400, {"error": str(tx_resp)}
+
+
+def _check_transaction(tx):
+    """
+    Returns the reason, why the node would reject tx as invalid or non-standard, or None.
+    """
+    if tx["version"] > MAX_TRANSACTION_VERSION:
+        return f"transaction version {tx['version']} is not supported"
+
+    try:
+        serialize_transaction(tx)
+    except ValueError as err:
+        return f"transaction is not valid: {err}"
+
+    compute_mass = calc_compute_mass(tx)
+    if compute_mass > MAXIMUM_STANDARD_TRANSACTION_MASS:
+        return (
+            f"transaction mass of {compute_mass} is larger than max allowed size "
+            f"of {MAXIMUM_STANDARD_TRANSACTION_MASS}"
+        )
 
 
 """
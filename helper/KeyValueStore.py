@@ -1,20 +1,18 @@
 # encoding: utf-8
-from sqlalchemy import select, update, insert
+from sqlalchemy import select, text, update, insert
+from sqlalchemy.dialects.postgresql import insert as upsert_statement
 
-from dbsession import async_session
+from dbsession import async_session, async_session_primary
 from models.Variable import KeyValueModel
 
 
 async def get(key):
     async with async_session() as s:
-        result = await s.execute(
-            select(KeyValueModel.value).where(KeyValueModel.key == key)
-        )
-        return result.scalar()
+        return await read(s, key)
 
 
 async def set(key, value):
-    async with async_session() as s:
+    async with async_session_primary() as s:
         result = await s.execute(
             update(KeyValueModel).where(KeyValueModel.key == key).values(value=value)
         )
@@ -28,3 +26,58 @@ async def set(key, value):
         await s.commit()
 
         return True
+
+
+async def read(s, key):
+    """
+    Returns the value of key within the session s.
+    """
+    result = await s.execute(
+        select(KeyValueModel.value).where(KeyValueModel.key == key)
+    )
+    return result.scalar()
+
+
+async def upsert(s, key, value, where=None):
+    """
+    Inserts or updates key within the session s, without committing. With where, an
+    existing value is only updated if the condition holds.
+    """
+    await s.execute(
+        upsert_statement(KeyValueModel)
+        .values(key=key, value=value)
+        .on_conflict_do_update(
+            index_elements=[KeyValueModel.key], set_={"value": value}, where=where
+        )
+    )
+
+
+async def advance_watermark(
+    s, key, target, batch_size, add_batch, start=0, lock_id=None
+):
+    """
+    Moves the watermark stored under key (start if not stored) up to target in steps of
+    batch_size. Each step awaits add_batch(s, watermark, upper) and commits it together
+    with the new watermark. With lock_id, each step holds the advisory lock until its
+    commit and None is returned, if another session holds it. Returns the watermark.
+    """
+    while True:
+        if lock_id is not None:
+            acquired = await s.execute(
+                text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": lock_id}
+            )
+            if not acquired.scalar():
+                await s.rollback()
+                return None
+
+        # read under the lock, another session may have moved it
+        watermark = await read(s, key)
+        watermark = int(watermark) if watermark is not None else start
+        if watermark >= target:
+            await s.rollback()
+            return watermark
+
+        upper = min(target, watermark + batch_size)
+        await add_batch(s, watermark, upper)
+        await upsert(s, key, str(upper))
+        await s.commit()
@@ -0,0 +1,219 @@
+# encoding: utf-8
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+
+# Shares the results of the background pollers between gunicorn workers.
+# One worker (the leader) holds an exclusive lock on LEADER_LOCK_FILE, runs the pollers
+# and writes the snapshot to SNAPSHOT_FILE (tmpfs if available) once per second. All other
+# workers only read the snapshot. If the leader dies, its lock is released by the OS and the
+# next worker calling is_leader() takes over.
+# The default file names contain the pid of the gunicorn master, so several deployments on
+# one host don't share them. A snapshot written under another master is ignored.
+# Large values, which change in parts, are written as lines to a file of their own. The
+# leader appends the changes, the followers read only the appended lines, see write_lines().
+
+MULTI_WORKER = int(os.getenv("WORKERS", "1")) > 1
+
+_MASTER_PID = os.getppid()
+_SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+LEADER_LOCK_FILE = os.getenv(
+    "LEADER_LOCK_FILE",
+    os.path.join(tempfile.gettempdir(), f"spectre-rest-server-{_MASTER_PID}.lock"),
+)
+SNAPSHOT_FILE = os.getenv(
+    "SNAPSHOT_FILE",
+    os.path.join(_SHM_DIR, f"spectre-rest-server-{_MASTER_PID}-snapshot.json"),
+)
+
+_logger = logging.getLogger(__name__)
+
+_lock_fd = None
+_snapshot = {}
+_snapshot_mtime = None
+# a value was published since the last flush()
+_changed = False
+_subscribers = {}
+# name -> (header, offset, mtime) of the lines file read so far by read_lines()
+_lines_read = {}
+
+
+def is_leader():
+    """
+    Returns True if this worker is responsible for polling. Always True in single worker mode.
+    """
+    global _lock_fd
+
+    if not MULTI_WORKER or _lock_fd is not None:
+        return True
+
+    fd = os.open(LEADER_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+
+    _lock_fd = fd
+    _logger.info(f"Worker {os.getpid()} elected as leader for background polling.")
+    return True
+
+
+def get(key, default=None):
+    return _snapshot.get(key, default)
+
+
+def subscribe(key, callback):
+    """
+    Registers a callback, which is called with the new value when a follower receives an update for key.
+    """
+    _subscribers.setdefault(key, []).append(callback)
+
+
+def publish(key, value):
+    """
+    Sets the value of key. The followers receive it with the next flush() of the leader.
+    """
+    global _changed
+
+    _snapshot[key] = value
+    _changed = True
+
+
+async def flush():
+    """
+    Writes the snapshot, if a value was published since the last call. Called by the leader.
+    """
+    global _changed
+
+    if not MULTI_WORKER or not _changed:
+        return
+
+    _changed = False
+    snapshot = {"master": _MASTER_PID, "values": dict(_snapshot)}
+    await asyncio.to_thread(_write_snapshot, snapshot)
+
+
+def _write_snapshot(snapshot):
+    tmp_file = f"{SNAPSHOT_FILE}.{os.getpid()}"
+    with open(tmp_file, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_file, SNAPSHOT_FILE)
+
+
+def _read_snapshot():
+    with open(SNAPSHOT_FILE) as f:
+        return json.load(f)
+
+
+async def refresh():
+    """
+    Loads the snapshot written by the leader, if it changed since the last call.
+    """
+    global _snapshot_mtime
+
+    try:
+        mtime = os.stat(SNAPSHOT_FILE).st_mtime_ns
+        if mtime == _snapshot_mtime:
+            return
+
+        snapshot = await asyncio.to_thread(_read_snapshot)
+    except (OSError, ValueError) as err:
+        _logger.debug(f"Snapshot not available: {err}")
+        return
+
+    _snapshot_mtime = mtime
+
+    if snapshot.get("master") != _MASTER_PID:
+        _logger.debug("Ignoring the snapshot of a previous run.")
+        return
+
+    for key, value in snapshot["values"].items():
+        if _snapshot.get(key) != value:
+            _snapshot[key] = value
+            for callback in _subscribers.get(key, []):
+                callback(value)
+
+
+def _lines_file(name):
+    return f"{os.path.splitext(SNAPSHOT_FILE)[0]}-{name}.lines"
+
+
+async def write_lines(name, lines, append):
+    """
+    Writes lines (strings ending with a newline) to the file of name, either appended or
+    as a new file. Called by the leader.
+    """
+    if not MULTI_WORKER:
+        return
+
+    await asyncio.to_thread(_write_lines, _lines_file(name), lines, append)
+
+
+def _write_lines(path, lines, append):
+    if append:
+        with open(path, "a") as f:
+            f.write("".join(lines))
+        return
+
+    tmp_file = f"{path}.{os.getpid()}"
+    with open(tmp_file, "w") as f:
+        # a new file has a new header
+        f.write(f"{_MASTER_PID} {time.time_ns()}\n")
+        f.writelines(lines)
+    os.replace(tmp_file, path)
+
+
+def _read_lines(path, header, offset):
+    lines = []
+    rest = b""
+    with open(path, "rb") as f:
+        first_line = f.readline()
+        if first_line != header:
+            offset = len(first_line)
+        f.seek(offset)
+
+        # in chunks, the GIL is released in between
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            chunk = rest + chunk
+            # the leader may be appending the last line
+            end = chunk.rfind(b"\n") + 1
+            lines += chunk[:end].decode().splitlines(keepends=True)
+            rest = chunk[end:]
+            offset += end
+
+    return first_line, offset, lines
+
+
+async def read_lines(name):
+    """
+    Returns (lines, new file) with the lines written by the leader since the last call. If
+    new file is True, the lines are the whole file. Returns None if nothing was written.
+    """
+    path = _lines_file(name)
+    header, offset, mtime = _lines_read.get(name, (None, 0, None))
+    try:
+        stat = os.stat(path)
+        # a new file may have the same size
+        if stat.st_size == offset and stat.st_mtime_ns == mtime:
+            return None
+
+        first_line, offset, lines = await asyncio.to_thread(
+            _read_lines, path, header, offset
+        )
+    except OSError as err:
+        _logger.debug(f"{name} snapshot not available: {err}")
+        return None
+
+    _lines_read[name] = (first_line, offset, stat.st_mtime_ns)
+
+    if first_line.split(b" ")[0] != str(_MASTER_PID).encode():
+        _logger.debug(f"Ignoring the {name} snapshot of a previous run.")
+        return None
+
+    return lines, first_line != header
@@ -1,46 +1,104 @@
 # encoding: utf-8
+import asyncio
+import json
 import logging
+import os
+import tempfile
 import time
 
-import aiocache
 import aiohttp
-from aiocache import cached
+
+from helper import KeyValueStore, WorkerSnapshot
+
+IS_SQL_DB_CONFIGURED = os.getenv("SQL_URI") is not None
+MARKET_DATA_FILE = os.getenv(
+    "MARKET_DATA_FILE",
+    os.path.join(tempfile.gettempdir(), "spectre-rest-server-market-data.json"),
+)
 
 FLOOD_DETECTED = False
-CACHE = None
 
 _logger = logging.getLogger(__name__)
 
-aiocache.logger.setLevel(logging.WARNING)
+_refresh_lock = asyncio.Lock()
 
 
-@cached(ttl=120)
 async def get_spr_price():
-    return (await get_spr_market_data())["current_price"]["usd"]
+    market_data = await get_spr_market_data()
+    return market_data["current_price"]["usd"] if market_data else None
 
 
-@cached(ttl=300)
 async def get_spr_market_data():
+    """
+    Returns the last known market data or None. Never queries CoinGecko, this is done
+    in the background by refresh_spr_market_data().
+    """
+    return WorkerSnapshot.get("market_data")
+
+
+async def refresh_spr_market_data():
+    """
+    Queries CoinGecko and publishes the market data. Concurrent calls share one request.
+    The last good value is persisted, so it is available right after a restart.
+    """
     global FLOOD_DETECTED
-    global CACHE
-    if not FLOOD_DETECTED or time.time() - FLOOD_DETECTED > 300:
+
+    if _refresh_lock.locked():
+        # a refresh is already running, wait for its result
+        async with _refresh_lock:
+            return WorkerSnapshot.get("market_data")
+
+    async with _refresh_lock:
+        if WorkerSnapshot.get("market_data") is None:
+            market_data = await _load_market_data()
+            if market_data:
+                WorkerSnapshot.publish("market_data", market_data)
+
+        if FLOOD_DETECTED and time.time() - FLOOD_DETECTED < 300:
+            return WorkerSnapshot.get("market_data")
+
         _logger.debug("Querying CoinGecko now.")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                "https://api.coingecko.com/api/v3/coins/spectre-network", timeout=10
-            ) as resp:
-                if resp.status == 200:
-                    FLOOD_DETECTED = False
-                    CACHE = (await resp.json())["market_data"]
-                    return CACHE
-                elif resp.status == 429:
-                    FLOOD_DETECTED = time.time()
-                    if CACHE:
-                        _logger.warning("Using cached value. 429 detected.")
-                    _logger.warning("Rate limit exceeded.")
-                else:
-                    _logger.error(
-                        f"Did not retrieve the market data. Status code {resp.status}"
-                    )
-
-    return CACHE
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(
+                    "https://api.coingecko.com/api/v3/coins/spectre-network",
+                    timeout=10,
+                ) as resp:
+                    if resp.status == 200:
+                        FLOOD_DETECTED = False
+                        market_data = (await resp.json())["market_data"]
+                        WorkerSnapshot.publish("market_data", market_data)
+                        await _save_market_data(market_data)
+                    elif resp.status == 429:
+                        FLOOD_DETECTED = time.time()
+                        _logger.warning("Rate limit exceeded. Using last value.")
+                    else:
+                        _logger.error(
+                            f"Did not retrieve the market data. Status code {resp.status}"
+                        )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            _logger.error(f"Did not retrieve the market data. {err!r}")
+
+        return WorkerSnapshot.get("market_data")
+
+
+async def _load_market_data():
+    try:
+        if IS_SQL_DB_CONFIGURED:
+            return json.loads((await KeyValueStore.get("market_data")) or "null")
+
+        with open(MARKET_DATA_FILE) as f:
+            return json.load(f)
+    except Exception as err:
+        _logger.debug(f"No persisted market data: {err!r}")
+
+
+async def _save_market_data(market_data):
+    try:
+        if IS_SQL_DB_CONFIGURED:
+            await KeyValueStore.set("market_data", json.dumps(market_data))
+        else:
+            with open(MARKET_DATA_FILE, "w") as f:
+                json.dump(market_data, f)
+    except Exception as err:
+        _logger.error(f"Could not persist market data: {err!r}")
@@ -25,7 +25,7 @@ def tx_output_serialized(tx_output):
     size += 8  # value
     size += 2  # scriptpubkey version
     size += 8  # length of script pub key
-    size += len(tx_output["scriptPublicKey"]["scriptPublicKey"]) / 2
+    size += len(tx_output["scriptPublicKey"]["scriptPublicKey"]) // 2
     return size
 
 
@@ -36,7 +36,7 @@ def tx_input_serialized(tx_input):
     size = 0
     size += outpoint_size(tx_input)  # previous outpoint size
     size += 8  # length of signature script
-    size += len(tx_input["signatureScript"]) / 2
+    size += len(tx_input["signatureScript"]) // 2
     size += 8  # sequence
     return size
 
@@ -53,7 +53,7 @@ def tx_serialized_size(tx):
     size += 8  # gas
     size += 32  # hash size payload hash
     size += 8  # length of the payload
-    size += len(tx.get("payload", "")) / 2  # length of payload
+    size += len(tx.get("payload", "")) // 2  # length of payload
 
     return size
 
@@ -75,7 +75,7 @@ def calc_compute_mass(tx):
 
     # count ALL outputs (script public key version + script public key)
     total_script_public_key_sum = sum(
-        [2 + (len(x["scriptPublicKey"]["scriptPublicKey"]) / 2) for x in tx["outputs"]]
+        [2 + (len(x["scriptPublicKey"]["scriptPublicKey"]) // 2) for x in tx["outputs"]]
     )
 
     # calc sum
@@ -0,0 +1,90 @@
+# encoding: utf-8
+import hashlib
+import struct
+
+# Consensus serialization of a transaction (dict like SubmitTxModel.dict()) and the
+# keyed BLAKE2b-256 hashes over it. The transaction id doesn't cover the signature
+# scripts and signature operation counts, the transaction hash covers everything.
+
+NATIVE_SUBNETWORK_ID = "00" * 20
+MAX_TRANSACTION_VERSION = 0
+
+
+def _hex_bytes(value, name, length=None):
+    try:
+        result = bytes.fromhex(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} is not a hex string")
+    if length is not None and len(result) != length:
+        raise ValueError(f"{name} must be {length} bytes")
+    return result
+
+
+def _var_bytes(value):
+    return struct.pack("<Q", len(value)) + value
+
+
+def serialize_transaction(tx, exclude_signature_scripts=False):
+    """
+    Returns the serialized transaction. Raises ValueError, if a field is not valid hex,
+    has the wrong length or is out of range.
+    """
+    parts = []
+    try:
+        parts.append(struct.pack("<HQ", tx["version"], len(tx["inputs"])))
+        for tx_input in tx["inputs"]:
+            outpoint = tx_input["previousOutpoint"]
+            parts.append(_hex_bytes(outpoint["transactionId"], "transactionId", 32))
+            parts.append(struct.pack("<I", outpoint["index"]))
+            if exclude_signature_scripts:
+                parts.append(_var_bytes(b""))
+            else:
+                signature_script = tx_input["signatureScript"]
+                parts.append(
+                    _var_bytes(_hex_bytes(signature_script, "signatureScript"))
+                )
+                parts.append(struct.pack("<B", tx_input["sigOpCount"]))
+            parts.append(struct.pack("<Q", tx_input["sequence"]))
+
+        parts.append(struct.pack("<Q", len(tx["outputs"])))
+        for tx_output in tx["outputs"]:
+            script_public_key = tx_output["scriptPublicKey"]
+            parts.append(
+                struct.pack("<QH", tx_output["amount"], script_public_key["version"])
+            )
+            parts.append(
+                _var_bytes(
+                    _hex_bytes(script_public_key["scriptPublicKey"], "scriptPublicKey")
+                )
+            )
+
+        parts.append(struct.pack("<Q", tx.get("lockTime") or 0))
+        parts.append(
+            _hex_bytes(
+                tx.get("subnetworkId") or NATIVE_SUBNETWORK_ID, "subnetworkId", 20
+            )
+        )
+        parts.append(struct.pack("<Q", tx.get("gas") or 0))
+        parts.append(_var_bytes(_hex_bytes(tx.get("payload") or "", "payload")))
+    except struct.error as err:
+        raise ValueError(f"Value out of range: {err}")
+
+    return b"".join(parts)
+
+
+def _hash(key, data):
+    return hashlib.blake2b(data, digest_size=32, key=key).hexdigest()
+
+
+def transaction_id(tx):
+    """
+    Returns the transaction id as hex string.
+    """
+    return _hash(b"TransactionID", serialize_transaction(tx, True))
+
+
+def transaction_hash(tx):
+    """
+    Returns the transaction hash as hex string.
+    """
+    return _hash(b"TransactionHash", serialize_transaction(tx))
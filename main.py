@@ -1,10 +1,12 @@
 # encoding: utf-8
+import asyncio
 import logging
 import os
 
 from starlette.responses import RedirectResponse
 
 from dbsession import create_all
+from helper import WorkerSnapshot
 from endpoints import (
     get_balance,
     get_utxos,
@@ -14,6 +16,7 @@ from endpoints import (
     get_spectred_info,
     get_network,
     get_fee_estimate,
+    get_mempool,
     get_price,
 )
 from endpoints.get_address_transactions import get_transactions_for_address
@@ -30,17 +33,24 @@ from endpoints.get_virtual_chain_blue_score import (
 from endpoints.spectred_requests.submit_transaction_request import (
     submit_a_new_transaction,
 )
-from helper import get_spr_market_data
+from migrations import migrate
 from server import app, spectred_client
 
 IS_SQL_DB_CONFIGURED = os.getenv("SQL_URI") is not None
+STARTUP_TIMEOUT = int(os.getenv("STARTUP_TIMEOUT", "30"))
+# apply the schema migrations (index builds) in the background on startup. Off by
+# default, run them as a deployment step instead: pipenv run python migrations.py
+SQL_MIGRATIONS = os.getenv("SQL_MIGRATIONS", "false") == "true"
+
+_logger = logging.getLogger(__name__)
+_background_tasks = set()
 
 print(
     f"Loaded: {get_balance}, {get_utxos}, {get_blocks}, {get_blockdag}, {get_circulating_supply}, "
     f"{get_spectred_info}, {get_network}, {get_fee_estimate}, {get_marketcap}, {get_hashrate}, {get_blockreward}"
     f"{get_halving} {health_state} {get_transaction}"
     f"{get_virtual_selected_parent_blue_score} {get_transactions_for_address}"
-    f"{submit_a_new_transaction} {calculate_transaction_mass} {get_price}"
+    f"{submit_a_new_transaction} {calculate_transaction_mass} {get_price} {get_mempool}"
 )
 
 if os.getenv("VSPC_REQUEST") == "true":
@@ -49,16 +59,50 @@ if os.getenv("VSPC_REQUEST") == "true":
     print(get_virtual_selected_parent_chain_from_block)
 
 
-@app.on_event("startup")
-async def startup():
-    # create db if needed
+async def warm_up():
+    # find spectred and create db if needed. Market data has its own poller.
+    warm_up_tasks = {"spectred": spectred_client.initialize_all()}
     if IS_SQL_DB_CONFIGURED:
-        await create_all(drop=False)
-    # get spectred
-    await get_spr_market_data()
+        warm_up_tasks["database"] = create_all(drop=False)
+
+    results = await asyncio.gather(
+        *(asyncio.wait_for(t, STARTUP_TIMEOUT) for t in warm_up_tasks.values()),
+        return_exceptions=True,
+    )
+
+    failed = set()
+    for name, result in zip(warm_up_tasks, results):
+        if isinstance(result, Exception):
+            _logger.warning(f"Startup of {name} failed: {result!r}")
+            failed.add(name)
+
+    if (
+        IS_SQL_DB_CONFIGURED
+        and SQL_MIGRATIONS
+        and "database" not in failed
+        and WorkerSnapshot.is_leader()
+    ):
+        # index builds on big tables take long, they must not delay the warm up
+        _start_background_task(run_migrations())
+
 
-    # find spectred before staring webserver
-    await spectred_client.initialize_all()
+async def run_migrations():
+    try:
+        await migrate()
+    except Exception as err:
+        _logger.error(f"Schema migration failed: {err!r}")
+
+
+def _start_background_task(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+@app.on_event("startup")
+async def startup():
+    # don't delay accepting traffic, /ready reports when the node snapshot is warm
+    _start_background_task(warm_up())
 
 
 @app.get("/", include_in_schema=False)
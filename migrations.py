@@ -0,0 +1,302 @@
+# encoding: utf-8
+import asyncio
+import json
+import logging
+import sys
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from dbsession import engine
+
+# Versioned schema changes, which create_all() can't do on existing tables.
+# Each migration is (version, index name or None, SQL). Index migrations use
+# CREATE INDEX CONCURRENTLY, so the tables stay writable while the index is built.
+# Applied migrations are never changed, add a new version instead.
+# The applied version is stored in vars.schema_version.
+
+MIGRATIONS = [
+    (
+        1,
+        "idx_txouts_outpoint_covering",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_txouts_outpoint_covering"
+        " ON transactions_outputs (transaction_id, index)"
+        " INCLUDE (amount, script_public_key_address)",
+    ),
+    (
+        2,
+        "idx_address_block_time_tx_id",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_address_block_time_tx_id"
+        " ON tx_id_address_mapping (address, block_time DESC, transaction_id)",
+    ),
+    (
+        3,
+        "idx_address_id",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_address_id"
+        " ON tx_id_address_mapping (address, id)",
+    ),
+    # replaced by idx_address_block_time_tx_id
+    (4, None, "DROP INDEX CONCURRENTLY IF EXISTS idx_address_block_time"),
+]
+
+# only one server instance migrates at a time
+_ADVISORY_LOCK_ID = 7_263_001
+
+# tables read by the queries of _plan_checks(), analyzed before the check
+_PLAN_CHECK_TABLES = [
+    "transactions",
+    "transactions_outputs",
+    "transactions_inputs",
+    "tx_id_address_mapping",
+    "blocks",
+]
+
+_logger = logging.getLogger(__name__)
+
+
+def _maintenance_engine():
+    """
+    Returns an engine without pool and statement timeout for long running statements.
+    Nothing set on its connections leaks into the pool of the server.
+    """
+    return create_async_engine(
+        engine.url,
+        poolclass=NullPool,
+        connect_args={"server_settings": {"statement_timeout": "0"}},
+    )
+
+
+async def _schema_version(conn):
+    result = await conn.execute(
+        text("SELECT value FROM vars WHERE key = 'schema_version'")
+    )
+    return int(result.scalar() or 0)
+
+
+async def _set_schema_version(conn, version):
+    await conn.execute(
+        text(
+            "INSERT INTO vars (key, value) VALUES ('schema_version', :version)"
+            " ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value"
+        ),
+        {"version": str(version)},
+    )
+
+
+async def _is_index_valid(conn, index_name):
+    """
+    Returns None if the index does not exist. A failed CREATE INDEX CONCURRENTLY leaves
+    an invalid index behind.
+    """
+    result = await conn.execute(
+        text(
+            "SELECT i.indisvalid FROM pg_index i"
+            " JOIN pg_class c ON c.oid = i.indexrelid"
+            " WHERE c.relname = :name AND pg_catalog.pg_table_is_visible(c.oid)"
+        ),
+        {"name": index_name},
+    )
+    return result.scalar()
+
+
+async def migrate():
+    """
+    Applies the migrations above the stored schema version. Returns the schema version.
+    """
+    maintenance_engine = _maintenance_engine()
+    try:
+        async with maintenance_engine.connect() as conn:
+            # CREATE INDEX CONCURRENTLY can't run inside a transaction
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+
+            acquired = await conn.execute(
+                text("SELECT pg_try_advisory_lock(:id)"), {"id": _ADVISORY_LOCK_ID}
+            )
+            if not acquired.scalar():
+                _logger.info("Schema migration is running in another instance.")
+                return None
+
+            try:
+                version = await _schema_version(conn)
+                for migration_version, index_name, sql in MIGRATIONS:
+                    if migration_version <= version:
+                        continue
+
+                    _logger.info(
+                        f"Applying schema migration {migration_version}: {sql}"
+                    )
+                    if index_name and await _is_index_valid(conn, index_name) is False:
+                        _logger.warning(f"Dropping invalid index {index_name}")
+                        await conn.execute(
+                            text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+                        )
+
+                    await conn.execute(text(sql))
+
+                    if index_name and not await _is_index_valid(conn, index_name):
+                        raise RuntimeError(f"Index {index_name} was not created")
+
+                    await _set_schema_version(conn, migration_version)
+                    version = migration_version
+                    _logger.info(f"Schema migration {migration_version} applied.")
+            finally:
+                await conn.execute(
+                    text("SELECT pg_advisory_unlock(:id)"), {"id": _ADVISORY_LOCK_ID}
+                )
+    finally:
+        await maintenance_engine.dispose()
+
+    return version
+
+
+def _plan_checks():
+    """
+    (name, statement, sample SQL, parameter, expected indexes) of the hot read queries. The
+    sample SQL selects a value for the parameter from the database. One of the expected
+    indexes must be used.
+    """
+    from queries import addresses, blocks, transactions
+
+    return [
+        (
+            "transactions by id",
+            transactions.transactions_query(frozenset()),
+            "SELECT array_agg(transaction_id) FROM"
+            " (SELECT transaction_id FROM transactions LIMIT 50) t",
+            "transaction_ids",
+            {"transactions_pkey"},
+        ),
+        (
+            "outputs by transaction id",
+            transactions.OUTPUTS_QUERY,
+            "SELECT array_agg(transaction_id) FROM"
+            " (SELECT transaction_id FROM transactions LIMIT 50) t",
+            "transaction_ids",
+            {"idx_txouts", "tx_id_and_index", "idx_txouts_outpoint_covering"},
+        ),
+        (
+            "acceptance by transaction id",
+            transactions.ACCEPTANCE_QUERY,
+            "SELECT array_agg(transaction_id) FROM"
+            " (SELECT transaction_id FROM transactions LIMIT 50) t",
+            "transaction_ids",
+            {"transactions_pkey"},
+        ),
+        (
+            "light previous outpoint resolution",
+            transactions.INPUTS_RESOLVED_LIGHT_QUERY,
+            "SELECT array_agg(transaction_id) FROM"
+            " (SELECT transaction_id FROM transactions LIMIT 50) t",
+            "transaction_ids",
+            {"idx_txouts_outpoint_covering"},
+        ),
+        (
+            "transaction ids of an address",
+            addresses.TX_IDS_FOR_ADDRESS_QUERY,
+            "SELECT address FROM tx_id_address_mapping"
+            " GROUP BY address ORDER BY count(*) DESC LIMIT 1",
+            "address",
+            {"idx_address_block_time_tx_id"},
+        ),
+        (
+            "transaction ids of several addresses",
+            addresses.TX_IDS_FOR_ADDRESSES_QUERY,
+            "SELECT array_agg(address) FROM (SELECT address FROM tx_id_address_mapping"
+            " GROUP BY address ORDER BY count(*) DESC LIMIT 200) a",
+            "addresses",
+            {"idx_address_block_time_tx_id"},
+        ),
+        (
+            "address mappings above a sync cursor",
+            addresses.MAPPINGS_FOR_ADDRESSES_QUERY,
+            "SELECT array_agg(address) FROM (SELECT address FROM tx_id_address_mapping"
+            " GROUP BY address ORDER BY count(*) DESC LIMIT 200) a",
+            "addresses",
+            {"idx_address_id"},
+        ),
+        (
+            "blocks by blue score range",
+            blocks.BLOCKS_BY_BLUE_SCORE_RANGE_QUERY,
+            "SELECT max(blue_score) - 1000 FROM blocks",
+            "from_blue_score",
+            {"idx_blue_score"},
+        ),
+    ]
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+async def check_query_plans():
+    """
+    EXPLAINs the hot read queries and returns a list of problems: an expected index is
+    not used or a big table is scanned sequentially.
+    """
+    defaults = {
+        "limit": 50,
+        "offset": 0,
+        "to_blue_score": 2**63 - 1,
+        "null_block_time": False,
+        "block_time": 2**63 - 1,
+        "transaction_id": "",
+        "cursor": 0,
+    }
+    problems = []
+
+    maintenance_engine = _maintenance_engine()
+    try:
+        async with maintenance_engine.connect() as conn:
+            await conn.execute(text(f"ANALYZE {', '.join(_PLAN_CHECK_TABLES)}"))
+            for name, statement, sample_sql, sample_param, indexes in _plan_checks():
+                sample = (await conn.execute(text(sample_sql))).scalar()
+                compiled = statement.compile(dialect=conn.dialect)
+                params = compiled.construct_params({**defaults, sample_param: sample})
+                result = await conn.exec_driver_sql(
+                    "EXPLAIN (FORMAT JSON) " + compiled.string,
+                    # a list of one tuple, a bare tuple with a list value is taken as many
+                    [tuple(params[p] for p in compiled.positiontup)],
+                )
+                plan = result.scalar()
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+                nodes = list(_plan_nodes(plan[0]["Plan"]))
+
+                used = {n["Index Name"] for n in nodes if "Index Name" in n}
+                seq_scans = {
+                    n["Relation Name"] for n in nodes if n["Node Type"] == "Seq Scan"
+                }
+                summary = ", ".join(
+                    f"{n['Node Type']} {n.get('Index Name', n.get('Relation Name', ''))}".strip()
+                    for n in nodes
+                )
+                _logger.info(f"{name}: {summary}")
+
+                if not used & indexes:
+                    problems.append(
+                        f"{name}: none of {sorted(indexes)} used ({summary})"
+                    )
+                if seq_scans:
+                    problems.append(f"{name}: sequential scan on {sorted(seq_scans)}")
+    finally:
+        await maintenance_engine.dispose()
+
+    return problems
+
+
+async def _main(args):
+    if "--check-plans" in args:
+        problems = await check_query_plans()
+        for problem in problems:
+            print(problem)
+        return 1 if problems else 0
+
+    print(f"Schema version {await migrate()}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
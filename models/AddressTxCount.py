@@ -0,0 +1,14 @@
+from sqlalchemy import Column, String, BigInteger
+
+from dbsession import Base
+
+
+class AddressTxCount(Base):
+    """
+    Number of tx_id_address_mapping rows per address, maintained incrementally by the
+    rest server. See update_address_tx_counts.
+    """
+
+    __tablename__ = "address_tx_counts"
+    address = Column(String, primary_key=True)
+    count = Column(BigInteger)
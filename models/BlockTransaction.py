@@ -0,0 +1,16 @@
+from sqlalchemy import Column, String, Integer
+
+from dbsession import Base
+
+
+class BlockTransaction(Base):
+    """
+    Transactions per block, an optional normalized copy of transactions.block_hash
+    maintained by the rest server. See update_block_transactions.
+    """
+
+    __tablename__ = "block_transactions"
+    block_hash = Column(String, primary_key=True)
+    transaction_id = Column(String, primary_key=True)
+    # coinbase first, then ordered by subnetwork id and transaction id
+    position = Column(Integer)
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, String, Integer, BigInteger, TIMESTAMP
+
+from dbsession import Base
+
+
+class HashrateHistory(Base):
+    """
+    Block with the highest difficulty (lowest bits) per hour and per day, maintained
+    incrementally by the rest server. See update_hashrate_history.
+    """
+
+    __tablename__ = "hashrate_history"
+    resolution = Column(String, primary_key=True)  # "hour" or "day"
+    bucket = Column(BigInteger, primary_key=True)  # start of the period in ms
+    bits = Column(Integer)
+    block_hash = Column(String)
+    blue_score = Column(BigInteger)
+    daa_score = Column(BigInteger)
+    timestamp = Column(TIMESTAMP(timezone=False))
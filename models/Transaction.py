@@ -40,6 +40,13 @@ class TransactionOutput(Base):
 Index("idx_txouts", TransactionOutput.transaction_id)
 Index("idx_txouts_addr", TransactionOutput.script_public_key_address)
 Index("tx_id_and_index", TransactionOutput.transaction_id, TransactionOutput.index)
+# added to existing databases by migrations.py
+Index(
+    "idx_txouts_outpoint_covering",
+    TransactionOutput.transaction_id,
+    TransactionOutput.index,
+    postgresql_include=["amount", "script_public_key_address"],
+)
 
 
 class TransactionInput(Base):
@@ -19,7 +19,14 @@ class TxAddrMapping(Base):
     )
 
 
-Index("idx_address_block_time", TxAddrMapping.address, TxAddrMapping.block_time)
 Index("idx_block_time", TxAddrMapping.block_time)
 Index("idx_tx_id", TxAddrMapping.transaction_id)
 Index("idx_tx_id_address_mapping", TxAddrMapping.transaction_id)
+# added to existing databases by migrations.py
+Index(
+    "idx_address_block_time_tx_id",
+    TxAddrMapping.address,
+    TxAddrMapping.block_time.desc(),
+    TxAddrMapping.transaction_id,
+)
+Index("idx_address_id", TxAddrMapping.address, TxAddrMapping.id)
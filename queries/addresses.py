@@ -0,0 +1,46 @@
+# encoding: utf-8
+from sqlalchemy import bindparam, text
+from sqlalchemy.future import select
+
+from models.TxAddrMapping import TxAddrMapping
+
+TX_IDS_FOR_ADDRESS_QUERY = (
+    select(TxAddrMapping.transaction_id)
+    .filter(TxAddrMapping.address == bindparam("address"))
+    .limit(bindparam("limit"))
+    .offset(bindparam("offset"))
+    .order_by(TxAddrMapping.block_time.desc())
+)
+
+# Newest transactions of several addresses, deduplicated, ordered by (block_time DESC,
+# transaction_id). Each address reads at most :limit rows from
+# idx_address_block_time_tx_id, the results are merged. Rows without block_time come
+# first, like in the index; :null_block_time is set for a cursor on such a row.
+TX_IDS_FOR_ADDRESSES_QUERY = text("""
+    SELECT DISTINCT m.transaction_id, m.block_time
+    FROM unnest(CAST(:addresses AS varchar[])) AS a(address)
+    CROSS JOIN LATERAL (
+        SELECT transaction_id, block_time FROM tx_id_address_mapping
+        WHERE address = a.address
+          AND (CAST(:null_block_time AS boolean)
+                 AND (block_time IS NOT NULL OR transaction_id > :transaction_id)
+               OR block_time < :block_time
+               OR block_time = :block_time AND transaction_id > :transaction_id)
+        ORDER BY block_time DESC, transaction_id
+        LIMIT :limit
+    ) m
+    ORDER BY m.block_time DESC, m.transaction_id
+    LIMIT :limit""")
+
+# mappings of several addresses above the sync cursor, via idx_address_id
+MAPPINGS_FOR_ADDRESSES_QUERY = text("""
+    SELECT m.id, m.address, m.transaction_id, m.block_time
+    FROM unnest(CAST(:addresses AS varchar[])) AS a(address)
+    CROSS JOIN LATERAL (
+        SELECT id, address, transaction_id, block_time FROM tx_id_address_mapping
+        WHERE address = a.address AND id > :cursor
+        ORDER BY id
+        LIMIT :limit
+    ) m
+    ORDER BY m.id
+    LIMIT :limit""")
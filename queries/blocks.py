@@ -0,0 +1,14 @@
+# encoding: utf-8
+from sqlalchemy import bindparam, select
+
+from models.Block import Block
+
+BLOCKS_BY_BLUE_SCORE_RANGE_QUERY = (
+    select(Block)
+    .where(
+        Block.blue_score >= bindparam("from_blue_score"),
+        Block.blue_score <= bindparam("to_blue_score"),
+    )
+    .order_by(Block.blue_score, Block.hash)
+    .limit(bindparam("limit"))
+)
@@ -0,0 +1,117 @@
+# encoding: utf-8
+from functools import lru_cache
+from typing import List
+
+from sqlalchemy import String, any_, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.future import select
+
+from dbsession import async_session
+from models.Block import Block
+from models.Transaction import Transaction, TransactionInput, TransactionOutput
+
+# hot queries are built once. "= ANY(array)" keeps the SQL independent of the number
+# of ids, so the compiled SQL and asyncpg's prepared statement are reused.
+TRANSACTION_IDS = bindparam("transaction_ids", type_=ARRAY(String))
+
+INPUTS_QUERY = select(TransactionInput).filter(
+    TransactionInput.transaction_id == any_(TRANSACTION_IDS)
+)
+
+INPUTS_RESOLVED_QUERY = (
+    select(TransactionInput, TransactionOutput)
+    .outerjoin(
+        TransactionOutput,
+        (TransactionOutput.transaction_id == TransactionInput.previous_outpoint_hash)
+        & (TransactionOutput.index == TransactionInput.previous_outpoint_index),
+    )
+    .filter(TransactionInput.transaction_id == any_(TRANSACTION_IDS))
+)
+
+# light mode only needs amount and address, covered by idx_txouts_outpoint_covering
+INPUTS_RESOLVED_LIGHT_QUERY = (
+    select(
+        TransactionInput,
+        TransactionOutput.amount,
+        TransactionOutput.script_public_key_address,
+    )
+    .outerjoin(
+        TransactionOutput,
+        (TransactionOutput.transaction_id == TransactionInput.previous_outpoint_hash)
+        & (TransactionOutput.index == TransactionInput.previous_outpoint_index),
+    )
+    .filter(TransactionInput.transaction_id == any_(TRANSACTION_IDS))
+)
+
+OUTPUTS_QUERY = select(TransactionOutput).filter(
+    TransactionOutput.transaction_id == any_(TRANSACTION_IDS)
+)
+
+ACCEPTANCE_QUERY = (
+    select(
+        Transaction.transaction_id,
+        Transaction.is_accepted,
+        Transaction.accepting_block_hash,
+        Block.blue_score.label("accepting_block_blue_score"),
+    )
+    .outerjoin(Block, Block.hash == Transaction.accepting_block_hash)
+    .filter(Transaction.transaction_id == any_(TRANSACTION_IDS))
+)
+
+
+@lru_cache(maxsize=128)
+def transactions_query(fields: frozenset):
+    return (
+        select_transactions(fields)
+        .filter(Transaction.transaction_id == any_(TRANSACTION_IDS))
+        .order_by(Transaction.block_time.desc(), Transaction.transaction_id)
+    )
+
+
+def select_transactions(fields: List[str]):
+    """
+    Selects only the transaction columns requested in fields. transaction_id is always
+    selected, as inputs and outputs are assigned by it. blocks is only joined for
+    accepting_block_blue_score.
+    """
+    columns = [
+        c
+        for c in Transaction.__table__.columns
+        if not fields or c.name in fields or c.name == "transaction_id"
+    ]
+    query = select(*columns)
+
+    if not fields or "accepting_block_blue_score" in fields:
+        query = query.add_columns(
+            Block.blue_score.label("accepting_block_blue_score")
+        ).join(Block, Transaction.accepting_block_hash == Block.hash, isouter=True)
+
+    return query
+
+
+OUTPOINTS_QUERY = text("""
+    SELECT o.transaction_id, o.index, o.amount, o.script_public_key_address
+    FROM unnest(CAST(:transaction_ids AS varchar[]), CAST(:indexes AS integer[]))
+        AS p(transaction_id, index)
+    JOIN transactions_outputs o
+        ON o.transaction_id = p.transaction_id AND o.index = p.index
+""")
+
+
+async def load_outpoints(outpoints):
+    """
+    Returns {(transaction id, index): (amount, address)} of the outpoints found in the
+    database.
+    """
+    async with async_session() as s:
+        rows = await s.execute(
+            OUTPOINTS_QUERY,
+            {
+                "transaction_ids": [transaction_id for transaction_id, _ in outpoints],
+                "indexes": [index for _, index in outpoints],
+            },
+        )
+        return {
+            (r.transaction_id, r.index): (r.amount, r.script_public_key_address)
+            for r in rows
+        }
@@ -12,7 +12,16 @@ from pydantic import BaseModel
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 
-from dbsession import async_session
+from dbsession import (
+    SQL_POOL_VALIDATE_INTERVAL,
+    async_session,
+    check_read_replicas,
+    get_metrics,
+    is_query_canceled,
+    read_engines,
+    validate_pools,
+)
+from helper import WorkerSnapshot
 from helper.LimitUploadSize import LimitUploadSize
 from spectred.SpectredMultiClient import SpectredMultiClient
 
@@ -38,6 +47,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # the next page of /addresses/full-transactions
+    expose_headers=["X-Next-Cursor"],
 )
 
 
@@ -90,6 +101,35 @@ async def ping_server():
     return result
 
 
+class ReadyResponse(BaseModel):
+    ready: bool = False
+    blue_score: Optional[int] = None
+
+
+@app.get("/ready", include_in_schema=False, response_model=ReadyResponse)
+async def ready():
+    """
+    Readiness: a synced spectred is known and the node snapshot is warm. Doesn't query any backend.
+    """
+    result = ReadyResponse(blue_score=WorkerSnapshot.get("blue_score"))
+    result.ready = result.blue_score is not None and any(
+        k.is_utxo_indexed and k.is_synced for k in spectred_client.spectreds
+    )
+
+    if not result.ready:
+        return JSONResponse(status_code=503, content=result.dict())
+
+    return result
+
+
+@app.get("/metrics/database", include_in_schema=False)
+async def database_metrics():
+    """
+    Statement cache and connection pool metrics of this worker.
+    """
+    return get_metrics()
+
+
 spectred_hosts = []
 
 for i in range(100):
@@ -102,10 +142,17 @@ if not spectred_hosts:
     raise Exception("Please set at least SPECTRED_HOST_1 environment variable.")
 
 spectred_client = SpectredMultiClient(spectred_hosts)
+WorkerSnapshot.subscribe("spectreds", spectred_client.set_states)
 
 
 @app.exception_handler(Exception)
 async def unicorn_exception_handler(request: Request, exc: Exception):
+    # SQL_STATEMENT_TIMEOUT also applies to endpoints without their own statement timeout
+    if is_query_canceled(exc):
+        return JSONResponse(
+            status_code=504, content={"detail": "Database query timed out."}
+        )
+
     await spectred_client.initialize_all()
     return JSONResponse(
         status_code=500,
@@ -119,4 +166,33 @@ async def unicorn_exception_handler(request: Request, exc: Exception):
 @app.on_event("startup")
 @repeat_every(seconds=60)
 async def periodical_blockdag():
-    await spectred_client.initialize_all()
+    if WorkerSnapshot.is_leader():
+        await spectred_client.initialize_all()
+        WorkerSnapshot.publish("spectreds", spectred_client.get_states())
+
+
+@app.on_event("startup")
+@repeat_every(seconds=1)
+async def refresh_worker_snapshot():
+    if not WorkerSnapshot.MULTI_WORKER:
+        return
+
+    # the leader writes the values published during the last second at once
+    if WorkerSnapshot.is_leader():
+        await WorkerSnapshot.flush()
+    else:
+        await WorkerSnapshot.refresh()
+
+
+@app.on_event("startup")
+@repeat_every(seconds=10)
+async def check_database_replicas():
+    if read_engines:
+        await check_read_replicas(WorkerSnapshot.get("blue_score"))
+
+
+@app.on_event("startup")
+@repeat_every(seconds=SQL_POOL_VALIDATE_INTERVAL)
+async def validate_database_connections():
+    if os.getenv("SQL_URI") is not None:
+        await validate_pools()
@@ -28,10 +28,10 @@ class SpectredClient(object):
             self.is_synced = False
             return False
 
-    async def request(self, command, params=None, timeout=5):
+    async def request(self, command, params=None, timeout=5, raw=False):
         with SpectredThread(self.spectred_host, self.spectred_port) as t:
             return await t.request(
-                command, params, wait_for_response=True, timeout=timeout
+                command, params, wait_for_response=True, timeout=timeout, raw=raw
             )
 
     async def notify(self, command, params, callback):
@@ -22,12 +22,34 @@ class SpectredMultiClient(object):
         for t in tasks:
             await t
 
-    async def request(self, command, params=None, timeout=5):
+    def get_states(self):
+        return [
+            {
+                "server_version": k.server_version,
+                "is_utxo_indexed": k.is_utxo_indexed,
+                "is_synced": k.is_synced,
+                "p2p_id": k.p2p_id,
+            }
+            for k in self.spectreds
+        ]
+
+    def set_states(self, states):
+        for k, state in zip(self.spectreds, states):
+            k.server_version = state["server_version"]
+            k.is_utxo_indexed = state["is_utxo_indexed"]
+            k.is_synced = state["is_synced"]
+            k.p2p_id = state["p2p_id"]
+
+    async def request(self, command, params=None, timeout=5, raw=False):
         try:
-            return await self.__get_spectred().request(command, params, timeout=timeout)
+            return await self.__get_spectred().request(
+                command, params, timeout=timeout, raw=raw
+            )
         except SpectredCommunicationError:
             await self.initialize_all()
-            return await self.__get_spectred().request(command, params, timeout=timeout)
+            return await self.__get_spectred().request(
+                command, params, timeout=timeout, raw=raw
+            )
 
     async def notify(self, command, params, callback):
         return await self.__get_spectred().notify(command, params, callback)
@@ -7,6 +7,7 @@ from google.protobuf import json_format
 from grpc._channel import _MultiThreadedRendezvous
 
 from . import messages_pb2_grpc
+from .message_to_dict import message_to_dict
 from .messages_pb2 import SpectredRequest
 
 
@@ -56,16 +57,19 @@ class SpectredThread(object):
     def __exit__(self, *args):
         self.__closing = True
 
-    async def request(self, command, params=None, wait_for_response=True, timeout=120):
+    async def request(
+        self, command, params=None, wait_for_response=True, timeout=120, raw=False
+    ):
         if wait_for_response:
             try:
                 async for resp in self.stub.MessageStream(
                     self.yield_cmd(command, params), timeout=120
                 ):
                     self.__queue.put_nowait("done")
-                    return json_format.MessageToDict(
-                        resp, always_print_fields_with_no_presence=True
-                    )
+                    if raw:
+                        # protobuf SpectredResponse without dict conversion
+                        return resp
+                    return message_to_dict(resp)
             except grpc.aio._call.AioRpcError as e:
                 raise SpectredCommunicationError(str(e))
 
@@ -74,11 +78,7 @@ class SpectredThread(object):
             async for resp in self.stub.MessageStream(self.yield_cmd(command, params)):
                 # self.__queue.put_nowait("done")
                 if callback_func:
-                    await callback_func(
-                        json_format.MessageToDict(
-                            resp, always_print_fields_with_no_presence=True
-                        )
-                    )
+                    await callback_func(message_to_dict(resp))
 
             print("loop done...")
 
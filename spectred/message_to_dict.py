@@ -0,0 +1,156 @@
+# encoding: utf-8
+import base64
+import math
+
+from google.protobuf import json_format
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.internal import type_checkers
+
+# Drop-in replacement for
+#   json_format.MessageToDict(message, always_print_fields_with_no_presence=True)
+# used on every spectred response. The converters are built once per message
+# descriptor (messages_pb2 / rpc_pb2) and cached, so the per-field type dispatch
+# of json_format is only paid when a message type is seen for the first time.
+# Key order and value formatting are identical to json_format.
+
+_INT64_TYPES = (
+    FieldDescriptor.TYPE_INT64,
+    FieldDescriptor.TYPE_UINT64,
+    FieldDescriptor.TYPE_SINT64,
+    FieldDescriptor.TYPE_FIXED64,
+    FieldDescriptor.TYPE_SFIXED64,
+)
+
+_CONVERTERS = {}
+
+
+def _float_to_json(value):
+    if math.isinf(value):
+        return "-Infinity" if value < 0 else "Infinity"
+    if math.isnan(value):
+        return "NaN"
+    return value
+
+
+def _float32_to_json(value):
+    if math.isinf(value) or math.isnan(value):
+        return _float_to_json(value)
+    return type_checkers.ToShortestFloat(value)
+
+
+def _bytes_to_json(value):
+    return base64.b64encode(value).decode("utf-8")
+
+
+def _enum_converter(enum_descriptor):
+    names = {v.number: v.name for v in enum_descriptor.values}
+
+    def convert(value):
+        return names.get(value, value)
+
+    return convert
+
+
+def _value_converter(field):
+    """
+    Returns a function converting a single (non-repeated) value of the field,
+    or None if the value is already JSON compatible.
+    """
+    if field.type == FieldDescriptor.TYPE_MESSAGE:
+        return _message_converter(field.message_type)
+    if field.type == FieldDescriptor.TYPE_ENUM:
+        return _enum_converter(field.enum_type)
+    if field.type in _INT64_TYPES:
+        return str
+    if field.type == FieldDescriptor.TYPE_DOUBLE:
+        return _float_to_json
+    if field.type == FieldDescriptor.TYPE_FLOAT:
+        return _float32_to_json
+    if field.type == FieldDescriptor.TYPE_BYTES:
+        return _bytes_to_json
+    return None
+
+
+def _is_set_float(value):
+    # proto3 treats -0.0 as a set value
+    return value != 0.0 or math.copysign(1.0, value) < 0
+
+
+def _message_converter(descriptor):
+    try:
+        return _CONVERTERS[descriptor.full_name]
+    except KeyError:
+        pass
+
+    if descriptor.full_name.startswith("google.protobuf.") or any(
+        f.message_type is not None and f.message_type.GetOptions().map_entry
+        for f in descriptor.fields
+    ):
+        # well known types and maps are not used by spectred. Keep json_format semantics.
+        def convert_fallback(message):
+            return json_format.MessageToDict(
+                message, always_print_fields_with_no_presence=True
+            )
+
+        _CONVERTERS[descriptor.full_name] = convert_fallback
+        return convert_fallback
+
+    # (name, json_name, is_repeated, has_presence, is_float, converter)
+    fields = []
+    # (json_name, default json value or None for repeated fields)
+    defaults = []
+
+    def convert(message):
+        js = {}
+        for name, json_name, repeated, presence, is_float, conv in fields:
+            if presence:
+                if message.HasField(name):
+                    value = getattr(message, name)
+                    js[json_name] = conv(value) if conv else value
+                continue
+
+            value = getattr(message, name)
+            if repeated:
+                if value:
+                    js[json_name] = [conv(v) for v in value] if conv else list(value)
+            elif value if not is_float else _is_set_float(value):
+                js[json_name] = conv(value) if conv else value
+
+        for json_name, default in defaults:
+            if json_name not in js:
+                js[json_name] = [] if default is None else default
+        return js
+
+    # register before building the field table to support recursive messages
+    _CONVERTERS[descriptor.full_name] = convert
+
+    for field in sorted(descriptor.fields, key=lambda f: f.number):
+        repeated = field.label == FieldDescriptor.LABEL_REPEATED
+        fields.append(
+            (
+                field.name,
+                field.json_name,
+                repeated,
+                not repeated and field.has_presence,
+                field.type in (FieldDescriptor.TYPE_DOUBLE, FieldDescriptor.TYPE_FLOAT),
+                _value_converter(field),
+            )
+        )
+
+    for field in descriptor.fields:
+        if field.label == FieldDescriptor.LABEL_REPEATED:
+            defaults.append((field.json_name, None))
+        elif not field.has_presence:
+            conv = _value_converter(field)
+            default = field.default_value
+            defaults.append((field.json_name, conv(default) if conv else default))
+
+    return convert
+
+
+def message_to_dict(message):
+    """
+    Converts a protobuf message into the same dict as
+    json_format.MessageToDict(message, always_print_fields_with_no_presence=True)
+    """
+    return _message_converter(message.DESCRIPTOR)(message)
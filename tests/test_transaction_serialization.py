@@ -0,0 +1,144 @@
+# encoding: utf-8
+# Reference vectors of the transaction id and hash, checked against the Kaspa reference
+# implementation (rusty-kaspa), whose transaction hashing Spectre inherits.
+# Run with "python -m pytest tests" or "python -m tests.test_transaction_serialization".
+import copy
+import struct
+
+from helper.transaction_serialization import (
+    serialize_transaction,
+    transaction_hash,
+    transaction_id,
+)
+
+EMPTY_TX = {
+    "version": 0,
+    "inputs": [],
+    "outputs": [],
+    "lockTime": 0,
+    "subnetworkId": "00" * 20,
+}
+
+# the example of submit_transaction_request.py
+EXAMPLE_TX = {
+    "version": 0,
+    "inputs": [
+        {
+            "previousOutpoint": {
+                "transactionId": "fa99f98b8e9b0758100d181eccb35a4c053b8265eccb5a89aadd794e087d9820",
+                "index": 1,
+            },
+            "signatureScript": "4187173244180496d67a94dc78f3d3651bc645139b636a9c79a4f1d36fdcc718e88e9880eeb0eb208d0c110f31a306556457bc37e1044aeb3fdd303bd1a8c1b84601",
+            "sequence": 0,
+            "sigOpCount": 1,
+        }
+    ],
+    "outputs": [
+        {
+            "amount": 100000,
+            "scriptPublicKey": {
+                "scriptPublicKey": "20167f5647a0e88ed3ac7834b5de4a5f0e56a438bcb6c97186a2c935303290ef6fac",
+                "version": 0,
+            },
+        },
+        {
+            "amount": 183448,
+            "scriptPublicKey": {
+                "scriptPublicKey": "2010352c822bf3c67637c84ea09ff90edc11fa509475ae1884cf5b971e53afd472ac",
+                "version": 0,
+            },
+        },
+    ],
+    "lockTime": 0,
+    "subnetworkId": "00" * 20,
+}
+
+EXAMPLE_TX_WITH_PAYLOAD = {**copy.deepcopy(EXAMPLE_TX), "payload": "deadbeef"}
+EXAMPLE_TX_WITH_PAYLOAD["lockTime"] = 123456
+
+
+def _u64(value):
+    return struct.pack("<Q", value)
+
+
+def test_serialize_empty_transaction():
+    expected = (
+        bytes(2)  # version
+        + _u64(0)  # inputs
+        + _u64(0)  # outputs
+        + _u64(0)  # lock time
+        + bytes(20)  # subnetwork id
+        + _u64(0)  # gas
+        + _u64(0)  # payload length
+    )
+    assert serialize_transaction(EMPTY_TX) == expected
+
+
+def test_serialize_transaction():
+    tx_input = EXAMPLE_TX["inputs"][0]
+    signature_script = bytes.fromhex(tx_input["signatureScript"])
+
+    expected = bytes(2) + _u64(1)
+    expected += bytes.fromhex(tx_input["previousOutpoint"]["transactionId"])
+    expected += struct.pack("<I", 1)
+    expected += _u64(len(signature_script)) + signature_script
+    expected += b"\x01"  # sig op count
+    expected += _u64(0)  # sequence
+    expected += _u64(2)
+    for tx_output in EXAMPLE_TX["outputs"]:
+        script_public_key = bytes.fromhex(
+            tx_output["scriptPublicKey"]["scriptPublicKey"]
+        )
+        expected += _u64(tx_output["amount"]) + bytes(2)
+        expected += _u64(len(script_public_key)) + script_public_key
+    expected += _u64(0) + bytes(20) + _u64(0) + _u64(0)
+
+    assert serialize_transaction(EXAMPLE_TX) == expected
+
+
+def test_serialize_transaction_without_signature_scripts():
+    serialized = serialize_transaction(EXAMPLE_TX, exclude_signature_scripts=True)
+    # outpoint, empty signature script, no sig op count, sequence
+    assert serialized[10 + 32 + 4 :][:16] == _u64(0) + _u64(0)
+    assert len(serialized) == len(serialize_transaction(EXAMPLE_TX)) - 66 - 1
+
+
+def test_transaction_id_and_hash():
+    vectors = [
+        (
+            EMPTY_TX,
+            "2c18d5e59ca8fc4c23d9560da3bf738a8f40935c11c162017fbf2c907b7e665c",
+            "c9e29784564c269ce2faaffd3487cb4684383018ace11133de082dce4bb88b0b",
+        ),
+        (
+            EXAMPLE_TX,
+            "4afb581ec77e92666061066482f4b6a8e168f2f2bc42e447ac3710ff3bb42765",
+            "1c290bc247f397b7a48dd9d5aa9223ec31595d82f7a10b9ba3857cbb24ed59c5",
+        ),
+        (
+            EXAMPLE_TX_WITH_PAYLOAD,
+            "06ef9f20c20e751be1331dad14a89fb6465e21acf40e64dcaad2e921a0e74061",
+            "e1e390d81f415c934049930538237979cb20c8f92bb5929f49778a5ff9b37aed",
+        ),
+    ]
+    for tx, tx_id, tx_hash in vectors:
+        assert transaction_id(tx) == tx_id
+        assert transaction_hash(tx) == tx_hash
+
+
+def test_invalid_transaction():
+    tx = copy.deepcopy(EXAMPLE_TX)
+    tx["inputs"][0]["previousOutpoint"]["transactionId"] = "abcd"
+    try:
+        serialize_transaction(tx)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError expected")
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} passed")